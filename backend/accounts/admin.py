@@ -1,15 +1,21 @@
 from django.contrib import admin
 
+from . import presence
 from .models import User, UserSettings
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ("username", "email", "phone_number", "is_online", "date_joined")
+    list_display = ("username", "email", "phone_number", "online", "date_joined")
     search_fields = ("username", "email", "phone_number", "display_name")
-    list_filter = ("is_online", "is_staff", "date_joined")
+    list_filter = ("is_staff", "date_joined")
     readonly_fields = ("date_joined", "last_login")
 
+    @admin.display(boolean=True, description="Online")
+    def online(self, obj):
+        # Presence lives in the cache; the is_online column is no longer written
+        return presence.ensure_presence(obj).is_online
+
 
 @admin.register(UserSettings)
 class UserSettingsAdmin(admin.ModelAdmin):
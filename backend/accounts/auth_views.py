@@ -9,6 +9,9 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.core.cache import cache
 from django.conf import settings
+from chat.middleware import invalidate_cached_user
+from . import presence
+from .serializers import PresenceSerializerMixin
 import random
 import string
 
@@ -97,7 +100,7 @@ class PhoneOTPVerifySerializer(serializers.Serializer):
 class GoogleAuthSerializer(serializers.Serializer):
     token = serializers.CharField()
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(PresenceSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 
@@ -208,9 +211,7 @@ def verify_phone_otp(request):
         }
     )
     
-    # Update online status
-    user.is_online = True
-    user.save(update_fields=['is_online'])
+    presence.mark_active(user)
     
     # Generate tokens
     tokens = get_tokens_for_user(user)
@@ -267,9 +268,7 @@ def google_auth(request):
             }
         )
         
-        # Update online status
-        user.is_online = True
-        user.save(update_fields=['is_online'])
+        presence.mark_active(user)
         
         # Generate tokens
         tokens = get_tokens_for_user(user)
@@ -294,7 +293,7 @@ def logout(request):
     POST /api/auth/logout/
     """
     user = request.user
-    user.is_online = False
-    user.save(update_fields=['is_online'])
+    presence.go_offline(user.id)
+    invalidate_cached_user(user.id)
     
     return Response({'message': 'Logged out successfully'})
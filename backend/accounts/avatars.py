@@ -0,0 +1,119 @@
+"""
+Avatar variants.
+
+An uploaded avatar is decoded once, EXIF-rotated, cropped square and saved at
+each of `AVATAR_SIZES` as WebP (where Pillow supports it) and JPEG; the
+original upload is not kept. File names include a hash of the upload, so a
+variant URL never changes content and can be cached forever (see
+`core.media.serve_media`). `User.avatar` points at the large JPEG for older
+clients, and `User.avatar_variants` maps size -> format -> storage name.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from PIL import Image, ImageOps, features
+
+AVATAR_SIZES = getattr(settings, "AVATAR_SIZES", {"small": 96, "medium": 320, "large": 1024})
+DEFAULT_VARIANT = "small"
+AVATAR_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"} if features.check("webp") else {"jpeg": "JPEG"}
+DEFAULT_FORMAT = next(iter(AVATAR_FORMATS))
+
+
+def _variant_name(digest, edge, extension):
+    return f"avatars/{digest[:2]}/{digest}-{edge}.{extension}"
+
+
+def _stored_names(user):
+    names = {name for formats in (user.avatar_variants or {}).values() for name in formats.values()}
+    if user.avatar:
+        names.add(user.avatar.name)
+    return names
+
+
+def _delete_unused(names, user_id):
+    """Delete old avatar files unless another user uploaded the same image."""
+    User = get_user_model()
+    for name in names:
+        # Variants of one upload share the "avatars/<aa>/<hash>-" prefix with the stored avatar
+        shared = Q(avatar__startswith=name.rsplit("-", 1)[0] + "-") if name.startswith("avatars/") else Q(avatar=name)
+        if not User.objects.filter(shared).exclude(pk=user_id).exists():
+            default_storage.delete(name)
+
+
+def build_variants(source):
+    """
+    Decode `source` (a file-like object) and store every size and format.
+
+    Returns the variants mapping; raises ValueError if it is not an image.
+    """
+    data = source.read()
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("RGB", (max(AVATAR_SIZES.values()),) * 2)
+            normalized = ImageOps.exif_transpose(image).convert("RGB")
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise ValueError("Not a valid image.") from exc
+
+    variants = {}
+    for variant, edge in AVATAR_SIZES.items():
+        # Never upscale: a small source keeps its own resolution
+        edge = min(edge, *normalized.size)
+        square = ImageOps.fit(normalized, (edge, edge), Image.LANCZOS)
+        variants[variant] = {}
+        for extension, image_format in AVATAR_FORMATS.items():
+            name = _variant_name(digest, AVATAR_SIZES[variant], extension)
+            if not default_storage.exists(name):
+                output = io.BytesIO()
+                square.save(output, format=image_format, quality=85)
+                name = default_storage.save(name, ContentFile(output.getvalue()))
+            variants[variant][extension] = name
+    return variants
+
+
+def set_avatar(user, source):
+    """Replace `user`'s avatar with variants built from the uploaded `source`."""
+    variants = build_variants(source)
+    old_names = _stored_names(user) - {name for formats in variants.values() for name in formats.values()}
+    largest = max(AVATAR_SIZES, key=AVATAR_SIZES.get)
+    user.avatar.name = variants[largest]["jpeg"]
+    user.avatar_variants = variants
+    user.save(update_fields=["avatar", "avatar_variants"])
+    transaction.on_commit(lambda: _delete_unused(old_names, user.pk))
+
+
+def clear_avatar(user):
+    old_names = _stored_names(user)
+    user.avatar = None
+    user.avatar_variants = {}
+    user.save(update_fields=["avatar", "avatar_variants"])
+    transaction.on_commit(lambda: _delete_unused(old_names, user.pk))
+
+
+def avatar_url(user, variant=DEFAULT_VARIANT, image_format=DEFAULT_FORMAT, request=None):
+    """URL of one avatar variant, falling back to the stored avatar for users not yet migrated."""
+    formats = (user.avatar_variants or {}).get(variant)
+    if formats:
+        url = default_storage.url(formats.get(image_format) or formats["jpeg"])
+    elif user.avatar:
+        url = user.avatar.url
+    else:
+        return None
+    return request.build_absolute_uri(url) if request else url
+
+
+def avatar_urls(user, request=None):
+    """Every variant and format, for clients that choose their own size."""
+    return {
+        variant: {
+            image_format: request.build_absolute_uri(default_storage.url(name)) if request else default_storage.url(name)
+            for image_format, name in formats.items()
+        }
+        for variant, formats in (user.avatar_variants or {}).items()
+    }
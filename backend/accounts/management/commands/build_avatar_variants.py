@@ -0,0 +1,22 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts import avatars
+
+
+class Command(BaseCommand):
+    help = 'Resizes avatars uploaded before variants existed into the standard sizes'
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        converted = failed = 0
+        for user in User.objects.exclude(avatar="").exclude(avatar__isnull=True).filter(avatar_variants={}).iterator():
+            try:
+                with user.avatar.open("rb") as source:
+                    avatars.set_avatar(user, source)
+            except (OSError, ValueError) as exc:
+                failed += 1
+                self.stderr.write(f'User {user.pk}: {exc}')
+                continue
+            converted += 1
+        self.stdout.write(self.style.SUCCESS(f'Converted {converted} avatar(s), {failed} failed.'))
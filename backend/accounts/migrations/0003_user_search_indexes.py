@@ -0,0 +1,59 @@
+# Generated by Django 5.0.9 on 2026-10-17 17:33
+
+import re
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import migrations, models
+from django.db.models.functions import Upper
+
+# icontains/istartswith compile to UPPER(column::text) LIKE UPPER(%s) on
+# PostgreSQL, so the trigram indexes cover that expression, not the column
+TRIGRAM_INDEXES = [
+    GinIndex(OpClass(Upper('username'), name='gin_trgm_ops'), name='accounts_user_username_trgm'),
+    GinIndex(OpClass(Upper('display_name'), name='gin_trgm_ops'), name='accounts_user_display_trgm'),
+]
+
+
+def backfill_phone_digits(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    for user in User.objects.exclude(phone_number=None).only('id', 'phone_number').iterator():
+        User.objects.filter(pk=user.pk).update(phone_digits=re.sub(r'\D', '', user.phone_number))
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Trigram GIN indexes make icontains on username/display_name indexable; PostgreSQL only
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    User = apps.get_model('accounts', 'User')
+    for index in TRIGRAM_INDEXES:
+        schema_editor.add_index(User, index)
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    User = apps.get_model('accounts', 'User')
+    for index in TRIGRAM_INDEXES:
+        schema_editor.remove_index(User, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user_allow_calls_user_allow_group_invite_user_bio_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='phone_digits',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.RunPython(backfill_phone_digits, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['phone_digits'], name='accounts_user_phone_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
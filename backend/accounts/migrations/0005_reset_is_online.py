@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def reset_is_online(apps, schema_editor):
+    # Presence moved to the cache, so stored flags would otherwise stay True forever
+    User = apps.get_model('accounts', 'User')
+    User.objects.filter(is_online=True).update(is_online=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_is_online, migrations.RunPython.noop),
+    ]
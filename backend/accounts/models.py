@@ -1,3 +1,5 @@
+import re
+
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
@@ -7,7 +9,11 @@ from core.utils import generate_upload_path
 class User(AbstractUser):
     display_name = models.CharField(max_length=255, blank=True)
     phone_number = models.CharField(max_length=32, unique=True, null=True, blank=True)
+    # Digits of phone_number only, kept in sync on save for indexed prefix search
+    phone_digits = models.CharField(max_length=32, blank=True, editable=False)
     avatar = models.ImageField(upload_to=generate_upload_path, null=True, blank=True)
+    # Size -> format -> storage name of the resized copies (see accounts.avatars)
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     status_message = models.CharField(max_length=255, blank=True)
     bio = models.TextField(max_length=500, blank=True)
     is_online = models.BooleanField(default=False)
@@ -26,9 +32,25 @@ class User(AbstractUser):
     allow_calls = models.BooleanField(default=True)
     allow_group_invite = models.BooleanField(default=True)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=["phone_digits"], name="accounts_user_phone_prefix_idx", opclasses=["varchar_pattern_ops"]),
+        ]
+
     def __str__(self) -> str:
         return self.username or self.display_name or "User"
 
+    def save(self, *args, **kwargs):
+        self.phone_digits = normalize_phone(self.phone_number)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "phone_number" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "phone_digits"}
+        super().save(*args, **kwargs)
+
+
+def normalize_phone(value) -> str:
+    return re.sub(r"\D", "", value or "")
+
 
 class UserSettings(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='settings')
@@ -0,0 +1,206 @@
+"""
+Write-behind presence.
+
+Online state lives in the cache rather than on the users table. A user is
+online while `presence:online:<id>` exists; WebSocket connects, `ping`
+heartbeats and logins refresh it, and it expires `PRESENCE_TTL` seconds after
+the last one. The time of the latest activity is also kept in the cache, and
+the user is queued (in the cache, so any process can drain it) for
+`flush_last_seen`, which `accounts.tasks.flush_presence` runs every
+`PRESENCE_FLUSH_INTERVAL` seconds to write `User.last_seen_at` in batches.
+
+`User.is_online` is no longer written; serializers read presence through
+`apply_presence` instead.
+"""
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+PRESENCE_TTL = getattr(settings, "PRESENCE_TTL", 120)
+PRESENCE_FLUSH_INTERVAL = getattr(settings, "PRESENCE_FLUSH_INTERVAL", 30)
+# Long enough for the cached value to outlive any pending flush in any process
+LAST_SEEN_CACHE_TTL = max(PRESENCE_FLUSH_INTERVAL * 10, 3600)
+FLUSH_BATCH_SIZE = 500
+# Pending users are numbered slots, so the queue needs only add/incr from the cache
+PENDING_SEQ_KEY = "presence:pending:seq"
+FLUSHED_SEQ_KEY = "presence:pending:flushed"
+FLUSH_LOCK_KEY = "presence:flush:lock"
+
+
+def _online_key(user_id):
+    return f"presence:online:{user_id}"
+
+
+def _connections_key(user_id):
+    return f"presence:connections:{user_id}"
+
+
+def _seen_key(user_id):
+    return f"presence:seen:{user_id}"
+
+
+def _queued_key(user_id):
+    return f"presence:queued:{user_id}"
+
+
+def _pending_key(seq):
+    return f"presence:pending:{seq}"
+
+
+def _to_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+def _record_activity(user_id, online):
+    now = time.time()
+    if online:
+        cache.set(_online_key(user_id), now, PRESENCE_TTL)
+    cache.set(_seen_key(user_id), now, LAST_SEEN_CACHE_TTL)
+    _queue_flush(user_id)
+
+
+def _queue_flush(user_id):
+    """Append a user to the pending queue unless they are already waiting for a flush."""
+    # The marker normally lives until the flush deletes it; the timeout only
+    # re-queues a user whose slot was lost, e.g. written after a flush read past it
+    if not cache.add(_queued_key(user_id), 1, PRESENCE_FLUSH_INTERVAL * 2):
+        return
+    cache.add(PENDING_SEQ_KEY, 0, None)
+    try:
+        seq = cache.incr(PENDING_SEQ_KEY)
+    except ValueError:
+        # Evicted between add and incr
+        seq = 1
+        cache.set(PENDING_SEQ_KEY, seq, None)
+    cache.set(_pending_key(seq), user_id, LAST_SEEN_CACHE_TTL)
+
+
+def heartbeat(user_id):
+    """Mark a user online for another PRESENCE_TTL seconds."""
+    _record_activity(user_id, online=True)
+    cache.touch(_connections_key(user_id), PRESENCE_TTL)
+
+
+def connect(user_id):
+    """Register an open socket for a user."""
+    cache.add(_connections_key(user_id), 0, PRESENCE_TTL)
+    try:
+        cache.incr(_connections_key(user_id))
+    except ValueError:
+        # Expired between add and incr
+        cache.set(_connections_key(user_id), 1, PRESENCE_TTL)
+    heartbeat(user_id)
+
+
+def disconnect(user_id):
+    """Close one socket; the user goes offline when their last socket closes."""
+    try:
+        remaining = cache.decr(_connections_key(user_id))
+    except ValueError:
+        remaining = 0
+    if remaining <= 0:
+        go_offline(user_id)
+    else:
+        _record_activity(user_id, online=True)
+
+
+def go_offline(user_id):
+    """Mark a user offline straight away, e.g. on logout."""
+    cache.delete_many([_online_key(user_id), _connections_key(user_id)])
+    _record_activity(user_id, online=False)
+
+
+def mark_active(user):
+    """Heartbeat for an HTTP login; also updates the in-memory instance for the response."""
+    heartbeat(user.id)
+    user.is_online = True
+    user.last_seen_at = _to_datetime(time.time())
+    user._presence_loaded = True
+
+
+def apply_presence(users):
+    """
+    Set `is_online` and `last_seen_at` on user instances from the cache.
+
+    One cache round trip covers the whole list, so member lists can be
+    serialized without a lookup per user.
+    """
+    users = [user for user in users if user is not None]
+    if not users:
+        return users
+    keys = []
+    for user in users:
+        keys += [_online_key(user.id), _seen_key(user.id)]
+    values = cache.get_many(keys)
+    for user in users:
+        user._presence_loaded = True
+        user.is_online = _online_key(user.id) in values
+        seen = values.get(_seen_key(user.id))
+        if seen is not None:
+            seen = _to_datetime(seen)
+            if user.last_seen_at is None or seen > user.last_seen_at:
+                user.last_seen_at = seen
+    return users
+
+
+def ensure_presence(user):
+    """`apply_presence` for a single user, skipped if their presence is already loaded."""
+    if not getattr(user, "_presence_loaded", False):
+        apply_presence([user])
+    return user
+
+
+def _flush_slots(first, last):
+    slots = [_pending_key(n) for n in range(first, last + 1)]
+    user_ids = set(cache.get_many(slots).values())
+    # Unqueue before reading timestamps, so activity from here on queues the user again
+    cache.delete_many(slots + [_queued_key(user_id) for user_id in user_ids])
+    seen = cache.get_many([_seen_key(user_id) for user_id in user_ids])
+    User = get_user_model()
+    users = [
+        User(id=user_id, last_seen_at=_to_datetime(seen[_seen_key(user_id)]))
+        for user_id in user_ids if _seen_key(user_id) in seen
+    ]
+    User.objects.bulk_update(users, ["last_seen_at"], batch_size=FLUSH_BATCH_SIZE)
+    return len(users)
+
+
+def flush_last_seen():
+    """Write the activity queued by every process to `last_seen_at` in batched UPDATEs; returns how many users."""
+    if not cache.add(FLUSH_LOCK_KEY, 1, PRESENCE_FLUSH_INTERVAL):
+        return 0  # Another worker is flushing
+    try:
+        seq = cache.get(PENDING_SEQ_KEY, 0)
+        flushed = cache.get(FLUSHED_SEQ_KEY, 0)
+        if flushed > seq:
+            flushed = 0  # The counter was evicted and restarted
+        written = 0
+        while flushed < seq:
+            last = min(seq, flushed + FLUSH_BATCH_SIZE)
+            written += _flush_slots(flushed + 1, last)
+            flushed = last
+            cache.set(FLUSHED_SEQ_KEY, flushed, None)
+        return written
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+
+
+class PresenceMixin:
+    """
+    Viewset mixin that loads presence for every user a GET response serializes.
+
+    Override `presence_users` to map the serialized instances to the users
+    they embed, e.g. conversation members.
+    """
+
+    def presence_users(self, instances):
+        return instances
+
+    def get_serializer(self, *args, **kwargs):
+        if args and args[0] is not None and self.request.method == "GET":
+            instances = args[0] if kwargs.get("many") else [args[0]]
+            apply_presence(self.presence_users(instances))
+        return super().get_serializer(*args, **kwargs)
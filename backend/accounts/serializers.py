@@ -2,9 +2,43 @@ from django.contrib.auth import authenticate
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from . import avatars, presence
 from .models import User, UserSettings
 
 
+class AvatarField(serializers.Field):
+    """Read-only URL of one resized avatar variant (small by default), absolute when a request is available."""
+
+    def __init__(self, variant=avatars.DEFAULT_VARIANT, **kwargs):
+        self.variant = variant
+        kwargs.setdefault("source", "*")
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, user):
+        return avatars.avatar_url(user, self.variant, request=self.context.get("request"))
+
+
+class PresenceListSerializer(serializers.ListSerializer):
+    """Loads presence for the whole list in one cache round trip before serializing it."""
+
+    def to_representation(self, data):
+        users = list(data.all() if hasattr(data, "all") else data)
+        presence.apply_presence([user for user in users if not getattr(user, "_presence_loaded", False)])
+        return super().to_representation(users)
+
+
+class PresenceSerializerMixin:
+    """
+    Reports `is_online` and `last_seen_at` from the cache (see accounts.presence)
+    instead of the stale columns, for users that have not had presence applied.
+    """
+
+    def to_representation(self, instance):
+        presence.ensure_presence(instance)
+        return super().to_representation(instance)
+
+
 class UserSettingsSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserSettings
@@ -17,8 +51,9 @@ class UserSettingsSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(PresenceSerializerMixin, serializers.ModelSerializer):
     settings = UserSettingsSerializer(read_only=True)
+    avatar = AvatarField()
     
     class Meta:
         model = User
@@ -45,31 +80,41 @@ class UserSerializer(serializers.ModelSerializer):
             "settings",
         ]
         read_only_fields = ["id", "is_online", "last_seen_at"]
+        list_serializer_class = PresenceListSerializer
+
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    """Identity and display fields only, for embedding in hot-path payloads"""
+    avatar = AvatarField()
+
+    class Meta:
+        model = User
+        fields = ["id", "username", "display_name", "avatar"]
+        read_only_fields = fields
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(PresenceSerializerMixin, serializers.ModelSerializer):
     """Detailed profile serializer with all fields"""
     settings = UserSettingsSerializer(read_only=True)
-    avatar_url = serializers.SerializerMethodField()
+    avatar = AvatarField()
+    avatar_url = AvatarField(variant="large")
+    avatar_variants = serializers.SerializerMethodField()
     
     class Meta:
         model = User
         fields = [
             "id", "username", "email", "display_name", "phone_number",
-            "avatar", "avatar_url", "status_message", "bio",
+            "avatar", "avatar_url", "avatar_variants", "status_message", "bio",
             "date_of_birth", "country", "city", "website",
             "show_phone_number", "show_last_seen", "show_profile_photo",
             "allow_calls", "allow_group_invite",
             "is_online", "last_seen_at", "date_joined", "settings"
         ]
         read_only_fields = ["id", "is_online", "last_seen_at", "date_joined"]
+        list_serializer_class = PresenceListSerializer
     
-    def get_avatar_url(self, obj):
-        if obj.avatar:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.avatar.url)
-        return None
+    def get_avatar_variants(self, obj):
+        return avatars.avatar_urls(obj, request=self.context.get('request'))
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -0,0 +1,8 @@
+from celery import shared_task
+
+
+@shared_task
+def flush_presence() -> int:
+    """Write queued last-seen times to the users table; scheduled by CELERY_BEAT_SCHEDULE."""
+    from .presence import flush_last_seen
+    return flush_last_seen()
@@ -0,0 +1,79 @@
+import io
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, override_settings
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from accounts import avatars
+from accounts.serializers import UserSerializer
+from core.media import serve_media
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def _photo(size=(3000, 2000), color=(200, 30, 30)):
+    output = io.BytesIO()
+    Image.new("RGB", size, color).save(output, format="JPEG")
+    return SimpleUploadedFile("camera.jpg", output.getvalue(), content_type="image/jpeg")
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class AvatarVariantTests(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass12345")
+        self.client.force_authenticate(user=self.user)
+
+    def test_upload_stores_square_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/auth/profile/avatar/", {"avatar": _photo()}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertEqual(set(self.user.avatar_variants), set(avatars.AVATAR_SIZES))
+        for variant, edge in avatars.AVATAR_SIZES.items():
+            for name in self.user.avatar_variants[variant].values():
+                with default_storage.open(name) as stored, Image.open(stored) as image:
+                    self.assertEqual(image.size, (edge, edge))
+
+        small = self.user.avatar_variants["small"][avatars.DEFAULT_FORMAT]
+        self.assertEqual(UserSerializer(self.user).data["avatar"], default_storage.url(small))
+        self.assertTrue(response.data["avatar_url"].endswith(self.user.avatar_variants["large"][avatars.DEFAULT_FORMAT]))
+
+        # MEDIA_URL is only routed when DEBUG is on, so call the view directly
+        served = serve_media(RequestFactory().get("/media/" + small), small)
+        self.assertEqual(served.status_code, 200)
+        self.assertIn("immutable", served["Cache-Control"])
+
+    def test_replacing_deletes_old_files_unless_shared(self):
+        other = User.objects.create_user(username="bob", password="pass12345")
+        with self.captureOnCommitCallbacks(execute=True):
+            avatars.set_avatar(self.user, _photo())
+            avatars.set_avatar(other, _photo())
+        shared = self.user.avatar_variants["small"]["jpeg"]
+        self.assertEqual(shared, other.avatar_variants["small"]["jpeg"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            avatars.set_avatar(self.user, _photo(color=(10, 10, 200)))
+        self.assertTrue(default_storage.exists(shared))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            avatars.clear_avatar(other)
+        self.assertFalse(default_storage.exists(shared))
+        self.assertIsNone(UserSerializer(other).data["avatar"])
+
+    def test_rejects_non_images(self):
+        upload = SimpleUploadedFile("notes.jpg", b"not an image", content_type="image/jpeg")
+        response = self.client.post("/api/auth/profile/avatar/", {"avatar": upload}, format="multipart")
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,73 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+
+from accounts import presence
+
+User = get_user_model()
+
+
+class PresenceTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="viewer", password="pass12345")
+        self.friend = User.objects.create_user(username="friend", password="pass12345")
+        self.client.force_authenticate(user=self.user)
+
+    def test_presence_is_kept_in_cache_until_last_socket_closes(self):
+        with CaptureQueriesContext(connection) as ctx:
+            presence.connect(self.friend.id)
+            presence.connect(self.friend.id)
+            presence.heartbeat(self.friend.id)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        presence.disconnect(self.friend.id)
+        self.assertTrue(presence.apply_presence([self.friend])[0].is_online)
+        presence.disconnect(self.friend.id)
+        friend = User.objects.get(pk=self.friend.pk)
+        presence.apply_presence([friend])
+        self.assertFalse(friend.is_online)
+        self.assertIsNotNone(friend.last_seen_at)
+
+    def test_last_seen_is_flushed_in_one_batch(self):
+        presence.heartbeat(self.user.id)
+        presence.heartbeat(self.friend.id)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(presence.flush_last_seen(), 2)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIsNotNone(User.objects.get(pk=self.friend.pk).last_seen_at)
+
+        # The queue is drained; later activity queues the user again
+        self.assertEqual(presence.flush_last_seen(), 0)
+        presence.heartbeat(self.friend.id)
+        presence.heartbeat(self.friend.id)
+        self.assertEqual(presence.flush_last_seen(), 1)
+
+    def test_flush_task_writes_activity_queued_by_any_process(self):
+        from accounts.tasks import flush_presence
+
+        presence.heartbeat(self.friend.id)
+        self.assertEqual(flush_presence(), 1)
+        self.assertIsNotNone(User.objects.get(pk=self.friend.pk).last_seen_at)
+
+    def test_serializers_report_cached_presence_not_the_column(self):
+        from accounts.serializers import UserSerializer
+
+        User.objects.filter(pk=self.user.pk).update(is_online=True)
+        presence.connect(self.friend.id)
+        stale, friend = User.objects.get(pk=self.user.pk), User.objects.get(pk=self.friend.pk)
+        self.assertFalse(UserSerializer(stale).data["is_online"])
+        self.assertEqual([user["is_online"] for user in UserSerializer([stale, friend], many=True).data], [False, True])
+
+    def test_user_list_reports_cached_presence(self):
+        self.client.post(reverse("users-set-online"))
+        presence.connect(self.friend.id)
+        response = self.client.get(reverse("users-list"))
+        self.assertEqual([user["is_online"] for user in response.data], [True])
+
+        self.client.post(reverse("users-set-offline"))
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_online)
+        self.assertFalse(presence.apply_presence([self.user])[0].is_online)
@@ -1,11 +1,12 @@
 from django.contrib.auth import get_user_model
-from django.utils import timezone
 from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from chat.middleware import invalidate_cached_user
+from . import avatars, presence
 from .models import UserSettings
 from .serializers import (
     AuthTokenSerializer, 
@@ -20,6 +21,7 @@ User = get_user_model()
 
 
 class UserViewSet(
+    presence.PresenceMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     mixins.UpdateModelMixin,
@@ -39,16 +41,12 @@ class UserViewSet(
 
     @action(detail=False, methods=["post"], url_path="set-online")
     def set_online(self, request):
-        request.user.is_online = True
-        request.user.last_seen_at = timezone.now()
-        request.user.save(update_fields=["is_online", "last_seen_at"])
+        presence.heartbeat(request.user.id)
         return Response({"status": "online"})
 
     @action(detail=False, methods=["post"], url_path="set-offline")
     def set_offline(self, request):
-        request.user.is_online = False
-        request.user.last_seen_at = timezone.now()
-        request.user.save(update_fields=["is_online", "last_seen_at"])
+        presence.go_offline(request.user.id)
         return Response({"status": "offline"})
 
 
@@ -89,10 +87,8 @@ class AuthViewSet(viewsets.ViewSet):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data["user"]
         
-        # Update user online status
-        user.is_online = True
-        user.last_seen_at = timezone.now()
-        user.save(update_fields=["is_online", "last_seen_at"])
+        # Presence lives in the cache; last_seen_at is written behind in batches
+        presence.mark_active(user)
         
         refresh = RefreshToken.for_user(user)
         user_serializer = UserSerializer(user)
@@ -120,12 +116,14 @@ class AuthViewSet(viewsets.ViewSet):
             if refresh_token:
                 token = RefreshToken(refresh_token)
                 token.blacklist()
+                invalidate_cached_user(token.get("user_id"))
             return Response({"detail": "Successfully logged out."}, status=status.HTTP_200_OK)
         except Exception:
             return Response({"detail": "Invalid token."}, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, methods=["get"], url_path="user", permission_classes=[permissions.IsAuthenticated])
     def get_current_user(self, request):
+        presence.apply_presence([request.user])
         serializer = UserSerializer(request.user)
         return Response(serializer.data)
 
@@ -171,8 +169,11 @@ class ProfileViewSet(viewsets.ViewSet):
             )
         
         user = request.user
-        user.avatar = request.FILES['avatar']
-        user.save(update_fields=['avatar'])
+        try:
+            avatars.set_avatar(user, request.FILES['avatar'])
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        invalidate_cached_user(user.id)
         
         serializer = ProfileSerializer(user, context={'request': request})
         return Response(serializer.data)
@@ -180,11 +181,8 @@ class ProfileViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['delete'], url_path='avatar')
     def delete_avatar(self, request):
         """Delete profile avatar"""
-        user = request.user
-        if user.avatar:
-            user.avatar.delete()
-        user.avatar = None
-        user.save(update_fields=['avatar'])
+        avatars.clear_avatar(request.user)
+        invalidate_cached_user(request.user.id)
         
         return Response({'message': 'Avatar deleted successfully'})
     
@@ -210,7 +208,8 @@ class ProfileViewSet(viewsets.ViewSet):
         
         # Show avatar based on privacy
         if user.show_profile_photo:
-            data['avatar'] = request.build_absolute_uri(user.avatar.url) if user.avatar else None
+            data['avatar'] = avatars.avatar_url(user, 'large', request=request)
+            data['avatar_variants'] = avatars.avatar_urls(user, request=request)
         
         # Show phone based on privacy
         if user.show_phone_number:
@@ -218,6 +217,7 @@ class ProfileViewSet(viewsets.ViewSet):
         
         # Show last seen based on privacy
         if user.show_last_seen:
+            presence.apply_presence([user])
             data['is_online'] = user.is_online
             data['last_seen_at'] = user.last_seen_at
         
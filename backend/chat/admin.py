@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from .models import (
-    Attachment, Conversation, ConversationMembership, Message, MessageReceipt,
+    Attachment, Blob, Conversation, ConversationMembership, Message, MessageReceipt,
     MessageReaction, Contact, PinnedMessage,
     Call, CallParticipant, Notification
 )
@@ -32,6 +32,12 @@ class AttachmentAdmin(admin.ModelAdmin):
     list_display = ("id", "message", "file_name", "file_size", "mime_type")
 
 
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ("id", "sha256", "size", "ref_count", "created_at")
+    search_fields = ("sha256",)
+
+
 admin.site.register(MessageReceipt)
 admin.site.register(MessageReaction)
 admin.site.register(Contact)
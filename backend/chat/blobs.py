@@ -0,0 +1,136 @@
+"""
+Deduplicated attachment storage.
+
+Uploads are stored once per distinct SHA-256 as a `Blob`, under a random
+name since media is served by name; attachments point at a blob and count as
+one reference each. Re-uploading a file that is already stored writes nothing,
+and forwarding a message only inserts attachment rows for the blobs it
+already has. When the last attachment referencing a blob is deleted, the
+blob, its file and its previews go with it.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from core.utils import file_sha256
+from .models import Attachment, Blob, BlobPreview
+from .previews import schedule_previews
+
+
+def store_blob(file, sha256=None):
+    """
+    Return the blob holding `file`'s content, storing it only if it is new.
+
+    Call inside a transaction that also records the reference: the blob row is
+    locked so a concurrent release cannot delete it in between.
+    """
+    digest = sha256 or file_sha256(file)
+    blob = Blob.objects.select_for_update().filter(sha256=digest).first()
+    if blob is not None:
+        return blob
+
+    blob = Blob(sha256=digest, size=file.size)
+    blob.file.save(file.name, file, save=False)
+    try:
+        with transaction.atomic():
+            blob.save()
+    except IntegrityError:
+        # Another upload of the same content won the insert
+        blob.file.storage.delete(blob.file.name)
+        blob = Blob.objects.select_for_update().get(sha256=digest)
+    return blob
+
+
+def add_refs(blob_ids):
+    """Record one new reference per id; pair every call with `release_blobs`."""
+    for blob_id, count in Counter(blob_ids).items():
+        Blob.objects.filter(pk=blob_id).update(ref_count=F("ref_count") + count)
+
+
+def create_attachments(message, files):
+    """Store uploaded `files` (deduplicated) and attach them to `message`."""
+    with transaction.atomic():
+        attachments = []
+        for file in files:
+            blob = store_blob(file)
+            attachments.append(Attachment(
+                message=message,
+                blob=blob,
+                file=blob.file.name,
+                file_name=file.name,
+                file_size=file.size,
+                mime_type=getattr(file, "content_type", None) or "application/octet-stream",
+                sha256=blob.sha256,
+            ))
+        Attachment.objects.bulk_create(attachments)
+        add_refs([attachment.blob_id for attachment in attachments])
+        schedule_previews(attachments)
+    return attachments
+
+
+def _adopt(attachment):
+    """Give an attachment from before blobs existed a blob, reusing its stored file where possible."""
+    with transaction.atomic():
+        if not attachment.sha256:
+            attachment.sha256 = file_sha256(attachment.file)
+            attachment.file.close()
+        legacy_name = attachment.file.name
+        blob = Blob.objects.select_for_update().filter(sha256=attachment.sha256).first()
+        if blob is None:
+            # The legacy file becomes the blob's file where it already is
+            blob = Blob.objects.create(sha256=attachment.sha256, file=legacy_name, size=attachment.file_size)
+        Attachment.objects.filter(pk=attachment.pk).update(blob=blob, file=blob.file.name, sha256=blob.sha256)
+        add_refs([blob.pk])
+        if blob.file.name != legacy_name:
+            storage = attachment.file.storage
+            transaction.on_commit(lambda: storage.delete(legacy_name))
+    attachment.blob, attachment.file.name = blob, blob.file.name
+
+
+def share_attachments(source, message):
+    """
+    Attach `source`'s attachments to `message` without copying any content.
+
+    Used for forwarding: each copy is a new attachment row referencing the
+    same blob.
+    """
+    with transaction.atomic():
+        attachments = []
+        for attachment in source.attachments.select_related("blob"):
+            if attachment.blob_id is None:
+                if not attachment.file or not attachment.file.storage.exists(attachment.file.name):
+                    continue
+                _adopt(attachment)
+            attachments.append(Attachment(
+                message=message,
+                blob_id=attachment.blob_id,
+                file=attachment.file.name,
+                file_name=attachment.file_name,
+                file_size=attachment.file_size,
+                mime_type=attachment.mime_type,
+                sha256=attachment.sha256,
+            ))
+        Attachment.objects.bulk_create(attachments)
+        add_refs([attachment.blob_id for attachment in attachments])
+        schedule_previews(attachments)
+    return attachments
+
+
+def release_blobs(blob_ids):
+    """Drop one reference per id, deleting blobs (and their files) that are no longer referenced."""
+    blob_ids = [blob_id for blob_id in blob_ids if blob_id is not None]
+    if not blob_ids:
+        return
+    with transaction.atomic():
+        for blob_id, count in Counter(blob_ids).items():
+            Blob.objects.filter(pk=blob_id, ref_count__gte=count).update(ref_count=F("ref_count") - count)
+        orphans = list(Blob.objects.select_for_update().filter(pk__in=set(blob_ids), ref_count=0))
+        if not orphans:
+            return
+        orphan_ids = [blob.pk for blob in orphans]
+        files = [blob.file for blob in orphans]
+        files += [preview.file for preview in BlobPreview.objects.filter(blob_id__in=orphan_ids)]
+        Blob.objects.filter(pk__in=orphan_ids).delete()
+        for file in files:
+            transaction.on_commit(lambda name=file.name, storage=file.storage: storage.delete(name))
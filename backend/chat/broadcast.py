@@ -0,0 +1,59 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speedup
+    orjson = None
+
+
+def conversation_group_name(conversation_id):
+    return f"conversation_{conversation_id}"
+
+
+def member_group_name(conversation_id, user_id):
+    """Group holding one user's sockets that are subscribed to one conversation"""
+    return f"conversation_{conversation_id}_user_{user_id}"
+
+
+def encode_frame(payload):
+    """Encode a client-facing payload to a WebSocket text frame."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=str).decode()
+    return json.dumps(payload, cls=DjangoJSONEncoder)
+
+
+def frame_event(payload, exclude_user_id=None, exclude_channels=None):
+    """
+    Build a channel-layer event carrying an already-encoded frame.
+
+    The frame is encoded once by the sender; every receiving consumer forwards
+    it verbatim in `broadcast_frame` instead of re-encoding it per socket.
+    `exclude_channels` are skipped by the layers in chat.layers.
+    """
+    event = {"type": "broadcast.frame", "text": encode_frame(payload)}
+    if exclude_user_id is not None:
+        event["exclude_user_id"] = exclude_user_id
+    if exclude_channels:
+        event["exclude_channels"] = list(exclude_channels)
+    return event
+
+
+def broadcast_to_conversation(conversation_id, payload):
+    """Synchronous fan-out for views and tasks."""
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(conversation_group_name(conversation_id), frame_event(payload))
+
+
+def call_peers_event(call_id):
+    """Internal event telling subscribed consumers that `call_id` gained or lost participants."""
+    return {"type": "call.peers_changed", "call_id": call_id}
+
+
+def notify_call_peers_changed(conversation_id, call_id):
+    """Synchronous form of `call_peers_event` for views."""
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(conversation_group_name(conversation_id), call_peers_event(call_id))
@@ -0,0 +1,169 @@
+"""
+Call lifecycle.
+
+Every state change is a conditional UPDATE on the current state, so two
+participants hanging up at once, or a hang-up racing the sweeper, can only
+move a call once. Unanswered calls become MISSED after `CALL_RING_TIMEOUT`
+seconds and ACTIVE calls are ended after `CALL_MAX_DURATION`; `sweep_calls`
+applies both and runs from Celery beat (see `chat.tasks.sweep_stale_calls`)
+or the `sweep_calls` management command.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from .broadcast import broadcast_to_conversation
+from .models import Call, CallParticipant, ConversationMembership
+
+CALL_RING_TIMEOUT = getattr(settings, "CALL_RING_TIMEOUT", 45)
+CALL_MAX_DURATION = getattr(settings, "CALL_MAX_DURATION", 4 * 60 * 60)
+
+RINGING_STATES = (Call.INITIATED, Call.RINGING)
+LIVE_STATES = RINGING_STATES + (Call.ACTIVE,)
+
+
+def live_calls(queryset, now=None):
+    """Restrict `queryset` to calls that are really in progress, even if the sweeper is behind."""
+    now = now or timezone.now()
+    return queryset.filter(
+        Q(state__in=RINGING_STATES, started_at__gte=now - timedelta(seconds=CALL_RING_TIMEOUT))
+        | Q(state=Call.ACTIVE, started_at__gte=now - timedelta(seconds=CALL_MAX_DURATION))
+    )
+
+
+def start_call(conversation_id, caller, call_type=Call.VOICE, participant_ids=None):
+    """
+    Create a ringing call and all of its participants in one transaction.
+
+    Participants are limited to members of the conversation; with no
+    `participant_ids` every other member is rung.
+    """
+    members = ConversationMembership.objects.filter(conversation_id=conversation_id).exclude(user_id=caller.id)
+    if participant_ids:
+        members = members.filter(user_id__in=participant_ids)
+    callee_ids = list(members.values_list("user_id", flat=True))
+    now = timezone.now()
+    with transaction.atomic():
+        call = Call.objects.create(
+            conversation_id=conversation_id,
+            caller=caller,
+            call_type=call_type,
+            state=Call.RINGING,
+            started_at=now,
+        )
+        CallParticipant.objects.bulk_create(
+            [CallParticipant(call=call, user=caller, is_answered=True, joined_at=now)]
+            + [CallParticipant(call=call, user_id=user_id) for user_id in callee_ids],
+            ignore_conflicts=True,
+        )
+    return call
+
+
+def _state_of(call_id):
+    return Call.objects.filter(pk=call_id).values_list("state", flat=True).first()
+
+
+def answer_call(call_id, user):
+    """Join `user` to a ringing or active call; returns the call's state, or None if they cannot join."""
+    now = timezone.now()
+    joined = CallParticipant.objects.filter(
+        call_id=call_id, user=user, call__state__in=LIVE_STATES
+    ).update(is_answered=True, joined_at=now, left_at=None)
+    if not joined:
+        # Other members of the conversation may join a call they were not rung for
+        call = Call.objects.filter(
+            pk=call_id, state__in=LIVE_STATES, conversation__memberships__user=user
+        ).first()
+        if call is None:
+            return None
+        CallParticipant.objects.update_or_create(
+            call=call, user=user, defaults={"is_answered": True, "joined_at": now, "left_at": None}
+        )
+    Call.objects.filter(pk=call_id, state__in=RINGING_STATES).update(state=Call.ACTIVE)
+    return _state_of(call_id)
+
+
+def decline_call(call_id, user):
+    """
+    Record that `user` declined; the call is DECLINED once nobody is left ringing.
+
+    Returns the call's state, or None if `user` was not being rung.
+    """
+    now = timezone.now()
+    declined = CallParticipant.objects.filter(
+        call_id=call_id, user=user, is_answered=False, left_at__isnull=True, call__state__in=RINGING_STATES
+    ).update(left_at=now)
+    if not declined:
+        return None
+    still_ringing = CallParticipant.objects.filter(call=OuterRef("pk"), is_answered=False, left_at__isnull=True)
+    _finish(
+        Call.objects.filter(pk=call_id, state__in=RINGING_STATES).exclude(Exists(still_ringing)),
+        Call.DECLINED, now,
+    )
+    return _state_of(call_id)
+
+
+def leave_call(call_id, user):
+    """
+    Hang up. A caller hanging up before anyone answers cancels the call as
+    MISSED; an active call ends once fewer than two people are left on it.
+
+    Returns the call's state, or None if `user` was not on the call.
+    """
+    now = timezone.now()
+    left = CallParticipant.objects.filter(
+        call_id=call_id, user=user, is_answered=True, left_at__isnull=True, call__state__in=LIVE_STATES
+    ).update(left_at=now)
+    if not left:
+        return None
+    _finish(
+        Call.objects.filter(pk=call_id, state__in=RINGING_STATES, caller=user),
+        Call.MISSED, now,
+    )
+    on_call = Count("participants", filter=Q(participants__is_answered=True, participants__left_at__isnull=True))
+    _finish(
+        Call.objects.filter(pk=call_id, state=Call.ACTIVE).annotate(on_call=on_call).filter(on_call__lt=2),
+        Call.ENDED, now,
+    )
+    return _state_of(call_id)
+
+
+def _finish(calls, state, now):
+    """Move `calls` to a final state and close their open participations; returns the calls moved."""
+    finished = []
+    with transaction.atomic():
+        for call_id, started_at, current in calls.values_list("pk", "started_at", "state"):
+            duration = int((now - started_at).total_seconds()) if current == Call.ACTIVE else 0
+            # Re-check the state in the UPDATE so a concurrent transition wins cleanly
+            if Call.objects.filter(pk=call_id, state=current).update(state=state, ended_at=now, duration=duration):
+                finished.append(call_id)
+        CallParticipant.objects.filter(call_id__in=finished, left_at__isnull=True).update(left_at=now)
+    return finished
+
+
+def sweep_calls(now=None):
+    """Mark unanswered calls MISSED and end calls past CALL_MAX_DURATION; returns how many changed."""
+    now = now or timezone.now()
+    missed = _finish(
+        Call.objects.filter(state__in=RINGING_STATES, started_at__lt=now - timedelta(seconds=CALL_RING_TIMEOUT)),
+        Call.MISSED, now,
+    )
+    ended = _finish(
+        Call.objects.filter(state=Call.ACTIVE, started_at__lt=now - timedelta(seconds=CALL_MAX_DURATION)),
+        Call.ENDED, now,
+    )
+
+    if missed or ended:
+        final_states = [(call_id, Call.MISSED) for call_id in missed] + [(call_id, Call.ENDED) for call_id in ended]
+        conversations = dict(Call.objects.filter(pk__in=missed + ended).values_list("pk", "conversation_id"))
+        for call_id, state in final_states:
+            broadcast_to_conversation(conversations[call_id], {
+                "type": "call.ended",
+                "conversation_id": conversations[call_id],
+                "call_id": call_id,
+                "state": state,
+            })
+    return len(missed) + len(ended)
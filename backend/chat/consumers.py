@@ -1,356 +1,413 @@
-import json
+import asyncio
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
-from .models import Conversation, Message, Call, CallParticipant
-from .serializers import MessageSerializer
+from accounts import presence
+from accounts.models import UserSettings
+from . import calls
+from .broadcast import call_peers_event, conversation_group_name, encode_frame, frame_event, member_group_name
+from .membership import get_member_conversation_ids, is_member
+from .models import (
+    Attachment, ConversationMembership, Message, MessageReaction, MessageReceipt,
+    CallParticipant
+)
+from .serializers import ATTACHMENTS_PREFETCH, MessageEventSerializer, read_watermarks
 
 User = get_user_model()
 
 
 class ConversationConsumer(AsyncJsonWebsocketConsumer):
+    """
+    One socket per conversation at ws/chat/<conversation_id>/.
+
+    Every handler takes the conversation id explicitly so UserConsumer can
+    reuse them over a single multiplexed connection.
+    """
+
+    # Read acks are coalesced per connection for this long before one watermark write
+    read_flush_delay = 0.5
+    # A typing start is re-announced at most this often while the user keeps typing
+    typing_interval = 3.0
+    # Typing stops by itself this long after the last start, so clients need not send stops
+    typing_timeout = 6.0
+    # Stops are held this long so a stop/start flap goes out as nothing at all
+    typing_stop_grace = 1.0
+    # ICE candidates trickled within this window go out as one frame per peer
+    ice_batch_delay = 0.05
+
+    def _init_state(self):
+        self._pending_reads = {}
+        self._read_flush_tasks = {}
+        self._typing = {}
+        self._typing_enabled = None
+        self._call_peers = {}
+        self._pending_ice = {}
+        self._ice_flush_tasks = {}
+        self._online = False
+
     async def connect(self):
+        self._init_state()
         try:
             self.conversation_id = self.scope["url_route"]["kwargs"]["conversation_id"]
-            self.group_name = f"conversation_{self.conversation_id}"
-            
+            self.group_name = conversation_group_name(self.conversation_id)
+
             print(f"[WebSocket] User attempting to connect: {self.scope['user']}")
-            
+
             if self.scope["user"].is_anonymous:
                 print(f"[WebSocket] Anonymous user, closing connection")
                 await self.close()
                 return
-                
-            is_member = await self._is_member()
+
+            is_member = await self._is_member(self.conversation_id)
             if not is_member:
                 print(f"[WebSocket] User {self.scope['user']} is not a member of conversation {self.conversation_id}")
                 await self.close()
                 return
-                
-            await self.channel_layer.group_add(self.group_name, self.channel_name)
+
+            await self._join_conversation(self.conversation_id)
             await self.accept()
+            await self._go_online()
             print(f"[WebSocket] Connection accepted for user {self.scope['user']} in conversation {self.conversation_id}")
-            
+
         except Exception as e:
             print(f"[WebSocket] Error during connect: {e}")
             await self.close()
 
     async def disconnect(self, code):
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await self._flush_all_reads()
+        await self._flush_all_ice()
+        await self._stop_all_typing()
+        await self._go_offline()
+        await self._leave_conversation(self.conversation_id)
 
     async def receive_json(self, content, **kwargs):
-        event_type = content.get("type")
-        
-        # Handle ping/pong for keeping connection alive
-        if event_type == "ping":
+        # Handle ping/pong for keeping connection alive; pings double as presence heartbeats
+        if content.get("type") == "ping":
+            await self._heartbeat()
             await self.send_json({"type": "pong"})
             return
-        
+
+        await self.handle_event(self.conversation_id, content)
+
+    async def handle_event(self, conversation_id, content):
+        event_type = content.get("type")
+
         if event_type == "message.send":
-            message = await self._create_message(content)
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    "type": "message.broadcast",
-                    "message": message,
-                },
-            )
+            message = await self._create_message(conversation_id, content)
+            await self._broadcast(conversation_id, {
+                "type": "message.new",
+                "conversation_id": conversation_id,
+                "data": message,
+            })
         elif event_type == "typing":
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    "type": "typing.indicator",
-                    "user_id": self.scope["user"].id,
-                    "username": self.scope["user"].username,
-                    "is_typing": content.get("is_typing", True),
-                },
-            )
-        elif event_type == "message.read":
-            message_id = content.get("message_id")
-            await self._mark_as_read(message_id)
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    "type": "message.read_receipt",
-                    "message_id": message_id,
-                    "user_id": self.scope["user"].id,
-                },
-            )
+            await self._typing_event(conversation_id, bool(content.get("is_typing", True)))
+        elif event_type in ("message.read", "message.read_up_to"):
+            message_ids = content.get("message_ids")
+            if message_ids is None:
+                message_ids = [content.get("message_id")]
+            await self._queue_read(conversation_id, message_ids)
         elif event_type == "message.edit":
             message_id = content.get("message_id")
             new_content = content.get("content")
-            edited_message = await self._edit_message(message_id, new_content)
+            edited_message = await self._edit_message(conversation_id, message_id, new_content)
             if edited_message:
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "message.edited",
-                        "message": edited_message,
-                    },
-                )
+                await self._broadcast(conversation_id, {
+                    "type": "message.edited",
+                    "conversation_id": conversation_id,
+                    "data": edited_message,
+                })
         elif event_type == "message.delete":
             message_id = content.get("message_id")
-            deleted_message = await self._delete_message(message_id)
+            deleted_message = await self._delete_message(conversation_id, message_id)
             if deleted_message:
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "message.deleted",
-                        "message_id": message_id,
-                    },
-                )
-        
+                await self._broadcast(conversation_id, {
+                    "type": "message.deleted",
+                    "conversation_id": conversation_id,
+                    "message_id": message_id,
+                })
+
         # WebRTC Call signaling
         elif event_type == "call.initiate":
-            await self._handle_call_initiate(content)
+            await self._handle_call_initiate(conversation_id, content)
         elif event_type == "call.answer":
-            await self._handle_call_answer(content)
+            await self._handle_call_answer(conversation_id, content)
         elif event_type == "call.reject":
-            await self._handle_call_reject(content)
+            await self._handle_call_reject(conversation_id, content)
         elif event_type == "call.end":
-            await self._handle_call_end(content)
+            await self._handle_call_end(conversation_id, content)
         elif event_type == "webrtc.offer":
-            await self._handle_webrtc_offer(content)
+            await self._handle_webrtc_offer(conversation_id, content)
         elif event_type == "webrtc.answer":
-            await self._handle_webrtc_answer(content)
+            await self._handle_webrtc_answer(conversation_id, content)
         elif event_type == "webrtc.ice_candidate":
-            await self._handle_ice_candidate(content)
+            await self._handle_ice_candidate(conversation_id, content)
 
-    async def message_broadcast(self, event):
-        await self.send_json({"type": "message.new", "data": event["message"]})
+    async def _broadcast(self, conversation_id, payload, exclude_user_id=None):
+        """
+        Encode `payload` once and fan it out to everyone in the conversation.
 
-    async def typing_indicator(self, event):
-        # Don't send typing indicator back to the sender
-        if event["user_id"] != self.scope["user"].id:
-            await self.send_json({
-                "type": "typing",
-                "user_id": event["user_id"],
-                "username": event["username"],
-                "is_typing": event["is_typing"],
-            })
-
-    async def message_read_receipt(self, event):
-        await self.send_json({
-            "type": "message.read",
-            "message_id": event["message_id"],
-            "user_id": event["user_id"],
-        })
-
-    async def message_edited(self, event):
-        await self.send_json({
-            "type": "message.edited",
-            "data": event["message"],
-        })
+        With `exclude_user_id` the layer skips this socket outright; the user's
+        other sockets still drop the frame in `broadcast_frame`.
+        """
+        exclude_channels = [self.channel_name] if exclude_user_id is not None else None
+        await self.channel_layer.group_send(
+            conversation_group_name(conversation_id),
+            frame_event(payload, exclude_user_id=exclude_user_id, exclude_channels=exclude_channels),
+        )
 
-    async def message_deleted(self, event):
-        await self.send_json({
-            "type": "message.deleted",
-            "message_id": event["message_id"],
-        })
+    async def call_peers_changed(self, event):
+        # Someone joined or left a call: peers are reloaded on the next signal
+        self._call_peers.pop(event["call_id"], None)
 
-    # WebRTC signaling broadcast methods
-    async def call_incoming(self, event):
-        await self.send_json({
-            "type": "call.incoming",
-            "call_id": event["call_id"],
-            "caller": event["caller"],
-            "call_type": event["call_type"],
-        })
+    async def broadcast_frame(self, event):
+        # Typing and WebRTC signaling are not echoed back to the user who sent them
+        if event.get("exclude_user_id") == self.scope["user"].id:
+            return
+        await self.send(text_data=event["text"])
+
+    @classmethod
+    async def encode_json(cls, content):
+        return encode_frame(content)
+
+    async def _join_conversation(self, conversation_id):
+        await self.channel_layer.group_add(conversation_group_name(conversation_id), self.channel_name)
+        # Call signaling addresses a user's sockets within one conversation only
+        await self.channel_layer.group_add(member_group_name(conversation_id, self.scope["user"].id), self.channel_name)
+
+    async def _leave_conversation(self, conversation_id):
+        await self.channel_layer.group_discard(conversation_group_name(conversation_id), self.channel_name)
+        await self.channel_layer.group_discard(member_group_name(conversation_id, self.scope["user"].id), self.channel_name)
+
+    async def _go_online(self):
+        await database_sync_to_async(presence.connect)(self.scope["user"].id)
+        self._online = True
+
+    async def _go_offline(self):
+        if self._online:
+            self._online = False
+            await database_sync_to_async(presence.disconnect)(self.scope["user"].id)
+
+    async def _heartbeat(self):
+        await database_sync_to_async(presence.heartbeat)(self.scope["user"].id)
+
+    async def _typing_event(self, conversation_id, is_typing):
+        """
+        Throttle and coalesce typing for one conversation.
+
+        Starts are announced once per `typing_interval`; each one pushes back
+        an automatic stop. A client stop is only sent after `typing_stop_grace`,
+        and is dropped if typing resumes first.
+        """
+        if self._typing_enabled is None:
+            self._typing_enabled = await self._shows_typing_indicator()
+        if not self._typing_enabled:
+            return
 
-    async def call_answered(self, event):
-        await self.send_json({
-            "type": "call.answered",
-            "call_id": event["call_id"],
-            "answerer": event["answerer"],
-        })
+        state = self._typing.get(conversation_id)
+        if not is_typing:
+            if state is not None:
+                self._schedule_typing_stop(conversation_id, self.typing_stop_grace)
+            return
 
-    async def call_rejected(self, event):
-        await self.send_json({
-            "type": "call.rejected",
-            "call_id": event["call_id"],
-            "rejector": event["rejector"],
-        })
+        now = asyncio.get_running_loop().time()
+        if state is None:
+            state = self._typing[conversation_id] = {"sent_at": None, "stop_task": None}
+        if state["sent_at"] is None or now - state["sent_at"] >= self.typing_interval:
+            state["sent_at"] = now
+            await self._broadcast_typing(conversation_id, True)
+        self._schedule_typing_stop(conversation_id, self.typing_timeout)
+
+    def _schedule_typing_stop(self, conversation_id, delay):
+        state = self._typing[conversation_id]
+        if state["stop_task"] is not None:
+            state["stop_task"].cancel()
+        state["stop_task"] = asyncio.ensure_future(self._stop_typing_later(conversation_id, delay))
+
+    async def _stop_typing_later(self, conversation_id, delay):
+        await asyncio.sleep(delay)
+        self._typing.pop(conversation_id, None)
+        await self._broadcast_typing(conversation_id, False)
+
+    async def _stop_typing(self, conversation_id):
+        state = self._typing.pop(conversation_id, None)
+        if state is None:
+            return
+        if state["stop_task"] is not None:
+            state["stop_task"].cancel()
+        await self._broadcast_typing(conversation_id, False)
+
+    async def _stop_all_typing(self):
+        for conversation_id in list(self._typing):
+            await self._stop_typing(conversation_id)
+
+    async def _broadcast_typing(self, conversation_id, is_typing):
+        user = self.scope["user"]
+        payload = {
+            "type": "typing",
+            "conversation_id": conversation_id,
+            "user_id": user.id,
+            "username": user.username,
+            "is_typing": is_typing,
+        }
+        if is_typing:
+            # Receivers should clear the indicator themselves if no refresh arrives in time
+            payload["expires_in"] = self.typing_timeout
+        await self._broadcast(conversation_id, payload, exclude_user_id=user.id)
 
-    async def call_ended(self, event):
-        await self.send_json({
-            "type": "call.ended",
-            "call_id": event["call_id"],
-            "ended_by": event["ended_by"],
-        })
+    @database_sync_to_async
+    def _shows_typing_indicator(self):
+        # Read once per connection; a changed setting applies from the next connect
+        enabled = UserSettings.objects.filter(user_id=self.scope["user"].id).values_list(
+            "show_typing_indicator", flat=True
+        ).first()
+        return enabled is not False
+
+    async def _queue_read(self, conversation_id, message_ids):
+        """Remember the highest acked id and schedule a single flush for the burst"""
+        ids = []
+        for message_id in message_ids if isinstance(message_ids, list) else [message_ids]:
+            try:
+                ids.append(int(message_id))
+            except (TypeError, ValueError):
+                continue
+        if not ids:
+            return
+        highest = max(ids)
+        pending = self._pending_reads.get(conversation_id)
+        if pending is None or highest > pending:
+            self._pending_reads[conversation_id] = highest
+        if conversation_id not in self._read_flush_tasks:
+            self._read_flush_tasks[conversation_id] = asyncio.ensure_future(
+                self._flush_reads_later(conversation_id)
+            )
 
-    async def webrtc_offer(self, event):
-        # Don't send offer back to sender
-        if event["sender_id"] != self.scope["user"].id:
-            await self.send_json({
-                "type": "webrtc.offer",
-                "call_id": event["call_id"],
-                "offer": event["offer"],
-                "sender_id": event["sender_id"],
-            })
+    async def _flush_reads_later(self, conversation_id):
+        await asyncio.sleep(self.read_flush_delay)
+        await self._flush_reads(conversation_id)
 
-    async def webrtc_answer(self, event):
-        # Don't send answer back to sender
-        if event["sender_id"] != self.scope["user"].id:
-            await self.send_json({
-                "type": "webrtc.answer",
-                "call_id": event["call_id"],
-                "answer": event["answer"],
-                "sender_id": event["sender_id"],
+    async def _flush_reads(self, conversation_id):
+        self._read_flush_tasks.pop(conversation_id, None)
+        message_id = self._pending_reads.pop(conversation_id, None)
+        if message_id is None:
+            return
+        advanced = await self._mark_as_read(conversation_id, message_id)
+        if advanced:
+            # message_id is the reader's new watermark: everything up to it is read
+            await self._broadcast(conversation_id, {
+                "type": "message.read",
+                "conversation_id": conversation_id,
+                "message_id": message_id,
+                "user_id": self.scope["user"].id,
+                "up_to": True,
             })
 
-    async def webrtc_ice_candidate(self, event):
-        # Don't send ice candidate back to sender
-        if event["sender_id"] != self.scope["user"].id:
-            await self.send_json({
-                "type": "webrtc.ice_candidate",
-                "call_id": event["call_id"],
-                "candidate": event["candidate"],
-                "sender_id": event["sender_id"],
-            })
+    async def _flush_all_reads(self):
+        for conversation_id, task in list(self._read_flush_tasks.items()):
+            task.cancel()
+            await self._flush_reads(conversation_id)
 
     @database_sync_to_async
-    def _is_member(self):
+    def _is_member(self, conversation_id):
         try:
-            return Conversation.objects.filter(
-                id=self.conversation_id, 
-                memberships__user=self.scope["user"]
-            ).exists()
+            return is_member(self.scope["user"].id, conversation_id)
         except Exception as e:
             print(f"[WebSocket] Error checking membership: {e}")
             return False
 
-    @database_sync_to_async
-    def _create_message(self, payload):
+    async def _create_message(self, conversation_id, payload):
         try:
-            message = Message.objects.create(
-                conversation_id=self.conversation_id,
+            message = await Message.objects.acreate(
+                conversation_id=conversation_id,
                 sender=self.scope["user"],
                 content=payload.get("content", ""),
                 message_type=payload.get("message_type", "text"),
             )
-            return MessageSerializer(message).data
+            # A message created over the socket has no attachments, reactions or other receipts yet
+            message._prefetched_objects_cache = {
+                "attachments": Attachment.objects.none(),
+                "receipts": MessageReceipt.objects.none(),
+                "reactions": MessageReaction.objects.none(),
+            }
+            # Nobody has read a message that did not exist a moment ago
+            return MessageEventSerializer(message, context={"read_watermarks": {conversation_id: []}}).data
         except Exception as e:
             print(f"[WebSocket] Error creating message: {e}")
             return None
 
-    @database_sync_to_async
-    def _mark_as_read(self, message_id):
-        from .models import MessageReceipt
-        if message_id:
-            MessageReceipt.objects.update_or_create(
-                message_id=message_id,
-                user=self.scope["user"],
-                defaults={"state": "read"}
-            )
+    async def _mark_as_read(self, conversation_id, message_id):
+        try:
+            return await ConversationMembership.objects.amark_read(conversation_id, self.scope["user"], message_id)
+        except Exception as e:
+            print(f"[WebSocket] Error marking messages as read: {e}")
+            return 0
 
-    @database_sync_to_async
-    def _edit_message(self, message_id, new_content):
+    async def _edit_message(self, conversation_id, message_id, new_content):
+        if not new_content:
+            return None
         try:
-            message = Message.objects.get(
+            message = await Message.objects.prefetch_related(ATTACHMENTS_PREFETCH, "receipts", "reactions").aget(
                 id=message_id,
-                conversation_id=self.conversation_id,
+                conversation_id=conversation_id,
                 sender=self.scope["user"]
             )
-            if new_content:
-                message.content = new_content
-                message.edited_at = timezone.now()
-                message.save()
-                return MessageSerializer(message).data
+            message.sender = self.scope["user"]
+            message.content = new_content
+            message.edited_at = timezone.now()
+            await message.asave(update_fields=["content", "edited_at"])
+            watermarks = [row async for row in read_watermarks(conversation_id)]
+            return MessageEventSerializer(message, context={"read_watermarks": {conversation_id: watermarks}}).data
         except Message.DoesNotExist:
             print(f"[WebSocket] Message {message_id} not found or not owned by user")
         except Exception as e:
             print(f"[WebSocket] Error editing message: {e}")
         return None
 
-    @database_sync_to_async
-    def _delete_message(self, message_id):
+    async def _delete_message(self, conversation_id, message_id):
         try:
-            message = Message.objects.get(
+            deleted = await Message.objects.filter(
                 id=message_id,
-                conversation_id=self.conversation_id,
+                conversation_id=conversation_id,
                 sender=self.scope["user"]
-            )
-            message.is_deleted = True
-            message.save()
-            return True
-        except Message.DoesNotExist:
-            print(f"[WebSocket] Message {message_id} not found or not owned by user")
+            ).aupdate(is_deleted=True)
+            if not deleted:
+                print(f"[WebSocket] Message {message_id} not found or not owned by user")
+            return bool(deleted)
         except Exception as e:
             print(f"[WebSocket] Error deleting message: {e}")
         return False
 
     # WebRTC Call handling methods
     @database_sync_to_async
-    def _create_call(self, call_type, participant_ids):
+    def _create_call(self, conversation_id, call_type, participant_ids):
         try:
-            call = Call.objects.create(
-                conversation_id=self.conversation_id,
-                caller=self.scope["user"],
-                call_type=call_type,
-                state=Call.INITIATED
-            )
-            
-            # Add caller as participant
-            CallParticipant.objects.create(
-                call=call,
-                user=self.scope["user"],
-                is_answered=True,
-                joined_at=timezone.now()
-            )
-            
-            # Add other participants
-            for user_id in participant_ids:
-                if user_id != self.scope["user"].id:
-                    CallParticipant.objects.create(
-                        call=call,
-                        user_id=user_id
-                    )
-            
-            return call.id
+            return calls.start_call(conversation_id, self.scope["user"], call_type, participant_ids).id
         except Exception as e:
             print(f"[WebSocket] Error creating call: {e}")
             return None
 
     @database_sync_to_async
-    def _update_call_state(self, call_id, state, user_action=None):
+    def _transition_call(self, transition, call_id):
         try:
-            call = Call.objects.get(id=call_id)
-            call.state = state
-            if state == Call.ENDED:
-                call.ended_at = timezone.now()
-                # Calculate duration
-                if call.started_at:
-                    duration = (call.ended_at - call.started_at).total_seconds()
-                    call.duration = int(duration)
-            call.save()
-            
-            if user_action == 'answer':
-                participant = CallParticipant.objects.get(call=call, user=self.scope["user"])
-                participant.is_answered = True
-                participant.joined_at = timezone.now()
-                participant.save()
-                
-                # Update call state to active when answered
-                call.state = Call.ACTIVE
-                call.save()
-            
-            return True
+            return transition(int(call_id), self.scope["user"])
+        except (TypeError, ValueError):
+            return None
         except Exception as e:
             print(f"[WebSocket] Error updating call state: {e}")
-            return False
+            return None
 
-    async def _handle_call_initiate(self, content):
+    async def _handle_call_initiate(self, conversation_id, content):
         call_type = content.get("call_type", "voice")  # voice or video
         participant_ids = content.get("participant_ids", [])
-        
-        call_id = await self._create_call(call_type, participant_ids)
+
+        call_id = await self._create_call(conversation_id, call_type, participant_ids)
         if call_id:
-            await self.channel_layer.group_send(
-                self.group_name,
+            await self._broadcast(
+                conversation_id,
                 {
                     "type": "call.incoming",
+                    "conversation_id": conversation_id,
                     "call_id": call_id,
                     "caller": {
                         "id": self.scope["user"].id,
@@ -362,95 +419,274 @@ class ConversationConsumer(AsyncJsonWebsocketConsumer):
                 }
             )
 
-    async def _handle_call_answer(self, content):
+    async def _handle_call_answer(self, conversation_id, content):
         call_id = content.get("call_id")
-        if call_id:
-            success = await self._update_call_state(call_id, Call.ACTIVE, 'answer')
-            if success:
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "call.answered",
-                        "call_id": call_id,
-                        "answerer": {
-                            "id": self.scope["user"].id,
-                            "username": self.scope["user"].username,
-                        }
+        state = await self._transition_call(calls.answer_call, call_id)
+        if state:
+            await self._call_peers_changed(conversation_id, call_id)
+            await self._broadcast(
+                conversation_id,
+                {
+                    "type": "call.answered",
+                    "conversation_id": conversation_id,
+                    "call_id": call_id,
+                    "state": state,
+                    "answerer": {
+                        "id": self.scope["user"].id,
+                        "username": self.scope["user"].username,
                     }
-                )
+                }
+            )
 
-    async def _handle_call_reject(self, content):
+    async def _handle_call_reject(self, conversation_id, content):
         call_id = content.get("call_id")
-        if call_id:
-            success = await self._update_call_state(call_id, Call.DECLINED)
-            if success:
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "call.rejected",
-                        "call_id": call_id,
-                        "rejector": {
-                            "id": self.scope["user"].id,
-                            "username": self.scope["user"].username,
-                        }
+        state = await self._transition_call(calls.decline_call, call_id)
+        if state:
+            await self._call_peers_changed(conversation_id, call_id)
+            await self._broadcast(
+                conversation_id,
+                {
+                    "type": "call.rejected",
+                    "conversation_id": conversation_id,
+                    "call_id": call_id,
+                    "state": state,
+                    "rejector": {
+                        "id": self.scope["user"].id,
+                        "username": self.scope["user"].username,
                     }
-                )
+                }
+            )
 
-    async def _handle_call_end(self, content):
+    async def _handle_call_end(self, conversation_id, content):
         call_id = content.get("call_id")
-        if call_id:
-            success = await self._update_call_state(call_id, Call.ENDED)
-            if success:
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "call.ended",
-                        "call_id": call_id,
-                        "ended_by": {
-                            "id": self.scope["user"].id,
-                            "username": self.scope["user"].username,
-                        }
+        state = await self._transition_call(calls.leave_call, call_id)
+        if state:
+            await self._call_peers_changed(conversation_id, call_id)
+            await self._broadcast(
+                conversation_id,
+                {
+                    "type": "call.ended",
+                    "conversation_id": conversation_id,
+                    "call_id": call_id,
+                    "state": state,
+                    "ended_by": {
+                        "id": self.scope["user"].id,
+                        "username": self.scope["user"].username,
                     }
-                )
+                }
+            )
 
-    async def _handle_webrtc_offer(self, content):
+    async def _handle_webrtc_offer(self, conversation_id, content):
         call_id = content.get("call_id")
-        offer = content.get("offer")
-        
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                "type": "webrtc.offer",
-                "call_id": call_id,
-                "offer": offer,
-                "sender_id": self.scope["user"].id,
-            }
-        )
-
-    async def _handle_webrtc_answer(self, content):
+        await self._signal(conversation_id, call_id, {
+            "type": "webrtc.offer",
+            "conversation_id": conversation_id,
+            "call_id": call_id,
+            "offer": content.get("offer"),
+            "sender_id": self.scope["user"].id,
+        }, content.get("target_user_id"))
+
+    async def _handle_webrtc_answer(self, conversation_id, content):
         call_id = content.get("call_id")
-        answer = content.get("answer")
-        
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                "type": "webrtc.answer",
-                "call_id": call_id,
-                "answer": answer,
-                "sender_id": self.scope["user"].id,
-            }
-        )
+        await self._signal(conversation_id, call_id, {
+            "type": "webrtc.answer",
+            "conversation_id": conversation_id,
+            "call_id": call_id,
+            "answer": content.get("answer"),
+            "sender_id": self.scope["user"].id,
+        }, content.get("target_user_id"))
+
+    async def _handle_ice_candidate(self, conversation_id, content):
+        """Queue trickled candidates and send each peer one batch per `ice_batch_delay`"""
+        key = (conversation_id, content.get("call_id"), content.get("target_user_id"))
+        candidates = content.get("candidates")
+        if candidates is None:
+            candidates = [content.get("candidate")]
+        elif not isinstance(candidates, list):
+            candidates = [candidates]
+        self._pending_ice.setdefault(key, []).extend(candidates)
+        if key not in self._ice_flush_tasks:
+            self._ice_flush_tasks[key] = asyncio.ensure_future(self._flush_ice_later(key))
+
+    async def _flush_ice_later(self, key):
+        await asyncio.sleep(self.ice_batch_delay)
+        await self._flush_ice(key)
+
+    async def _flush_ice(self, key):
+        self._ice_flush_tasks.pop(key, None)
+        candidates = self._pending_ice.pop(key, None)
+        if not candidates:
+            return
+        conversation_id, call_id, target_user_id = key
+        payload = {
+            "type": "webrtc.ice_candidate",
+            "conversation_id": conversation_id,
+            "call_id": call_id,
+            "sender_id": self.scope["user"].id,
+        }
+        if len(candidates) == 1:
+            payload["candidate"] = candidates[0]
+        else:
+            payload["candidates"] = candidates
+        await self._signal(conversation_id, call_id, payload, target_user_id)
+
+    async def _flush_all_ice(self):
+        for key, task in list(self._ice_flush_tasks.items()):
+            task.cancel()
+            await self._flush_ice(key)
+
+    async def _signal(self, conversation_id, call_id, payload, target_user_id=None):
+        """
+        Deliver call signaling to the call's other participants only.
+
+        Frames go to each participant's sockets subscribed to the conversation,
+        or just to `target_user_id` when the client addresses a single peer;
+        members who are not on the call, and the participants' sockets for
+        other conversations, never see them.
+        """
+        if target_user_id is not None:
+            try:
+                target_user_id = int(target_user_id)
+            except (TypeError, ValueError):
+                return
+        peers = await self._peers_of_call(conversation_id, call_id, target_user_id)
+        if target_user_id is not None:
+            peers = peers & {target_user_id}
+        if not peers:
+            return
+        event = frame_event(payload)
+        for user_id in peers:
+            await self.channel_layer.group_send(member_group_name(conversation_id, user_id), event)
 
-    async def _handle_ice_candidate(self, content):
-        call_id = content.get("call_id")
-        candidate = content.get("candidate")
-        
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                "type": "webrtc.ice_candidate",
-                "call_id": call_id,
-                "candidate": candidate,
-                "sender_id": self.scope["user"].id,
-            }
+    async def _call_peers_changed(self, conversation_id, call_id):
+        """Tell every subscribed consumer, this one included, to reload the call's peers."""
+        await self.channel_layer.group_send(conversation_group_name(conversation_id), call_peers_event(int(call_id)))
+
+    async def _peers_of_call(self, conversation_id, call_id, target_user_id=None):
+        try:
+            call_id = int(call_id)
+        except (TypeError, ValueError):
+            return frozenset()
+        peers = self._call_peers.get(call_id)
+        # An unknown target may have joined since the peers were cached
+        if peers is None or (target_user_id is not None and target_user_id not in peers):
+            peers = await self._load_call_peers(conversation_id, call_id)
+            if peers:
+                self._call_peers[call_id] = peers
+            else:
+                self._call_peers.pop(call_id, None)
+        return peers
+
+    @database_sync_to_async
+    def _load_call_peers(self, conversation_id, call_id):
+        user_ids = set(
+            CallParticipant.objects.filter(call_id=call_id, call__conversation_id=conversation_id)
+            .values_list("user_id", flat=True)
         )
+        # Only participants may signal; everyone but the sender is a peer
+        if self.scope["user"].id not in user_ids:
+            return frozenset()
+        return frozenset(user_ids - {self.scope["user"].id})
+
+
+class UserConsumer(ConversationConsumer):
+    """
+    One multiplexed socket per user at ws/chat/.
+
+    The client subscribes to any number of conversations over the same
+    connection and tags every event with `conversation_id`; the event
+    vocabulary is otherwise identical to ConversationConsumer.
+    """
+
+    async def connect(self):
+        self._init_state()
+        self.conversation_ids = set()
+
+        if self.scope["user"].is_anonymous:
+            print("[WebSocket] Anonymous user, closing connection")
+            await self.close()
+            return
+
+        await self.accept()
+        await self._go_online()
+        print(f"[WebSocket] Multiplexed connection accepted for user {self.scope['user']}")
+
+    async def disconnect(self, code):
+        await self._flush_all_reads()
+        await self._flush_all_ice()
+        await self._stop_all_typing()
+        await self._go_offline()
+        for conversation_id in self.conversation_ids:
+            await self._leave_conversation(conversation_id)
+        self.conversation_ids = set()
+
+    async def receive_json(self, content, **kwargs):
+        event_type = content.get("type")
+
+        if event_type == "ping":
+            await self._heartbeat()
+            await self.send_json({"type": "pong"})
+            return
+
+        if event_type == "subscribe":
+            await self._subscribe(self._requested_ids(content))
+            return
+
+        if event_type == "unsubscribe":
+            await self._unsubscribe(self._requested_ids(content))
+            return
+
+        try:
+            conversation_id = int(content.get("conversation_id"))
+        except (TypeError, ValueError):
+            conversation_id = None
+        if conversation_id not in self.conversation_ids:
+            await self.send_json({
+                "type": "error",
+                "detail": "Subscribe to the conversation before sending events to it.",
+                "conversation_id": content.get("conversation_id"),
+            })
+            return
+
+        await self.handle_event(conversation_id, content)
+
+    async def _subscribe(self, conversation_ids):
+        requested = [cid for cid in conversation_ids if cid not in self.conversation_ids]
+        allowed = await self._member_conversation_ids(requested) if requested else set()
+        for conversation_id in allowed:
+            await self._join_conversation(conversation_id)
+        self.conversation_ids.update(allowed)
+
+        denied = sorted(set(requested) - allowed)
+        await self.send_json({
+            "type": "subscribed",
+            "conversation_ids": sorted(self.conversation_ids),
+            "denied": denied,
+        })
+
+    async def _unsubscribe(self, conversation_ids):
+        for conversation_id in conversation_ids:
+            if conversation_id in self.conversation_ids:
+                await self._stop_typing(conversation_id)
+                await self._leave_conversation(conversation_id)
+                self.conversation_ids.discard(conversation_id)
+        await self.send_json({
+            "type": "unsubscribed",
+            "conversation_ids": sorted(self.conversation_ids),
+        })
+
+    def _requested_ids(self, content):
+        raw = content.get("conversation_ids")
+        if raw is None:
+            raw = [content.get("conversation_id")]
+        ids = []
+        for conversation_id in raw if isinstance(raw, list) else [raw]:
+            try:
+                ids.append(int(conversation_id))
+            except (TypeError, ValueError):
+                continue
+        return ids
+
+    @database_sync_to_async
+    def _member_conversation_ids(self, conversation_ids):
+        return get_member_conversation_ids(self.scope["user"].id) & set(conversation_ids)
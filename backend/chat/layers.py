@@ -0,0 +1,45 @@
+"""
+Channel layers whose group_send can skip channels.
+
+A group message carrying `exclude_channels` is not delivered to those
+channels at all, so the consumer that originated a typing or signaling event
+is never woken up to discard its own echo. Other layers simply pass the key
+through, and `ConversationConsumer.broadcast_frame` still drops the event.
+"""
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer as BaseInMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer as BaseRedisChannelLayer
+
+EXCLUDE_CHANNELS_KEY = "exclude_channels"
+
+
+def _split_exclusions(message):
+    excluded = message.get(EXCLUDE_CHANNELS_KEY)
+    if not excluded:
+        return message, ()
+    message = {key: value for key, value in message.items() if key != EXCLUDE_CHANNELS_KEY}
+    return message, set(excluded)
+
+
+class InMemoryChannelLayer(BaseInMemoryChannelLayer):
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        message, excluded = _split_exclusions(message)
+        self._clean_expired()
+        for channel in self.groups.get(group, set()):
+            if channel in excluded:
+                continue
+            try:
+                await self.send(channel, message)
+            except ChannelFull:
+                pass
+
+
+class RedisChannelLayer(BaseRedisChannelLayer):
+    def _map_channel_keys_to_connection(self, channel_names, message):
+        # group_send resolves the group's channels and hands them here before the bulk send
+        message, excluded = _split_exclusions(message)
+        if excluded:
+            channel_names = [channel for channel in channel_names if channel not in excluded]
+        return super()._map_channel_keys_to_connection(channel_names, message)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chat.calls import sweep_calls
+
+
+class Command(BaseCommand):
+    help = 'Marks unanswered calls as missed and ends abandoned calls (for deployments without Celery beat)'
+
+    def handle(self, *args, **options):
+        swept = sweep_calls()
+        self.stdout.write(self.style.SUCCESS(f'Swept {swept} stale call(s).'))
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ConversationMembership
+
+MEMBERSHIP_CACHE_TTL = getattr(settings, "CHAT_MEMBERSHIP_CACHE_TTL", 300)
+MEMBERSHIP_BATCH_SIZE = 1000
+
+
+def _cache_key(user_id):
+    return f"chat:memberships:{user_id}"
+
+
+def get_member_conversation_ids(user_id):
+    """Return the set of conversation ids a user belongs to, cached per user."""
+    key = _cache_key(user_id)
+    conversation_ids = cache.get(key)
+    if conversation_ids is None:
+        conversation_ids = frozenset(
+            ConversationMembership.objects.filter(user_id=user_id).values_list("conversation_id", flat=True)
+        )
+        cache.set(key, conversation_ids, MEMBERSHIP_CACHE_TTL)
+    return conversation_ids
+
+
+def is_member(user_id, conversation_id):
+    try:
+        conversation_id = int(conversation_id)
+    except (TypeError, ValueError):
+        return False
+    return conversation_id in get_member_conversation_ids(user_id)
+
+
+def invalidate_memberships(*user_ids):
+    """
+    Drop cached membership sets; call after any write that bypasses model signals.
+
+    The keys are dropped again once the surrounding transaction commits: a
+    concurrent reader between the write and the commit still sees the old
+    rows, and would otherwise cache them for MEMBERSHIP_CACHE_TTL.
+    """
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def add_members(conversation, user_ids, is_admin=False):
+    """
+    Add users to a conversation in bulk and return the ids that were newly added.
+
+    Unknown user ids are dropped with one lookup, and existing members are left
+    untouched; the insert ignores conflicts so a concurrent add cannot fail it.
+    """
+    user_ids = set(get_user_model().objects.filter(id__in=set(user_ids)).values_list("id", flat=True))
+    with transaction.atomic():
+        existing = set(
+            ConversationMembership.objects.filter(conversation=conversation, user_id__in=user_ids)
+            .values_list("user_id", flat=True)
+        )
+        added = sorted(user_ids - existing)
+        ConversationMembership.objects.bulk_create(
+            [ConversationMembership(conversation=conversation, user_id=user_id, is_admin=is_admin) for user_id in added],
+            batch_size=MEMBERSHIP_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+    # bulk_create skips post_save, so the membership signals never see these rows
+    invalidate_memberships(*added)
+    return added
+
+
+def remove_members(conversation, user_ids):
+    """Remove users from a conversation and return the ids that were removed."""
+    with transaction.atomic():
+        memberships = ConversationMembership.objects.filter(conversation=conversation, user_id__in=set(user_ids))
+        removed = sorted(memberships.values_list("user_id", flat=True))
+        # A regular delete, so post_delete (and with it the cache invalidation) runs per row
+        memberships.delete()
+    return removed
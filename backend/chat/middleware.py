@@ -1,6 +1,10 @@
+import threading
+import time
+from collections import OrderedDict
 from urllib.parse import parse_qs
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import AccessToken
@@ -8,20 +12,103 @@ from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 
 User = get_user_model()
 
+# Fields copied into the cached snapshot; consumers only need identity and display data
+USER_SNAPSHOT_FIELDS = (
+    "id", "username", "first_name", "last_name", "display_name", "avatar", "avatar_variants", "is_active",
+)
+
+
+class TokenUserCache:
+    """
+    In-process LRU of validated access token -> user snapshot.
+
+    Entries never outlive the token's own `exp` claim, and are additionally
+    capped at `ttl` seconds so profile changes and logouts in other processes
+    propagate quickly.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token_key):
+        with self._lock:
+            entry = self._entries.get(token_key)
+            if entry is None:
+                return None
+            snapshot, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token_key]
+                return None
+            self._entries.move_to_end(token_key)
+            return snapshot
+
+    def set(self, token_key, snapshot, token_exp):
+        expires_at = min(token_exp, time.time() + self.ttl)
+        with self._lock:
+            self._entries[token_key] = (snapshot, expires_at)
+            self._entries.move_to_end(token_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            stale = [key for key, (snapshot, _) in self._entries.items() if snapshot["id"] == user_id]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_user_cache = TokenUserCache(
+    maxsize=getattr(settings, "WS_AUTH_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "WS_AUTH_CACHE_TTL", 300),
+)
+
+
+def invalidate_cached_user(user_id):
+    """Drop every cached WebSocket token for a user, e.g. on logout."""
+    if user_id is not None:
+        token_user_cache.invalidate_user(user_id)
+
 
 @database_sync_to_async
-def get_user_from_token(token_key):
+def _load_user_snapshot(token_key):
     try:
         # Validate the token
         access_token = AccessToken(token_key)
         user_id = access_token['user_id']
-        
+
         # Get the user
-        user = User.objects.get(id=user_id)
-        return user
+        snapshot = User.objects.filter(id=user_id).values(*USER_SNAPSHOT_FIELDS).first()
+        if snapshot is None:
+            raise User.DoesNotExist(f"User {user_id} does not exist")
+        token_user_cache.set(token_key, snapshot, access_token['exp'])
+        return snapshot
     except (InvalidToken, TokenError, User.DoesNotExist) as e:
         print(f"[JWT Middleware] Token validation failed: {e}")
+        return None
+
+
+def _user_from_snapshot(snapshot):
+    # A fresh instance per connection so consumers never share mutable state
+    user = User(**snapshot)
+    user._state.adding = False
+    user._state.db = "default"
+    return user
+
+
+async def get_user_from_token(token_key):
+    snapshot = token_user_cache.get(token_key)
+    if snapshot is None:
+        snapshot = await _load_user_snapshot(token_key)
+    if snapshot is None:
         return AnonymousUser()
+    return _user_from_snapshot(snapshot)
 
 
 class JWTAuthMiddleware(BaseMiddleware):
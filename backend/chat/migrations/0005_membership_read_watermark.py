@@ -0,0 +1,49 @@
+# Generated by Django 5.0.9 on 2026-10-17 17:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_watermarks(apps, schema_editor):
+    """Seed watermarks from existing read receipts and count what is still unread."""
+    ConversationMembership = apps.get_model('chat', 'ConversationMembership')
+    Message = apps.get_model('chat', 'Message')
+    MessageReceipt = apps.get_model('chat', 'MessageReceipt')
+
+    for membership in ConversationMembership.objects.iterator():
+        last_read_id = MessageReceipt.objects.filter(
+            user_id=membership.user_id,
+            message__conversation_id=membership.conversation_id,
+            state='read',
+        ).aggregate(last=Max('message_id'))['last']
+        unread = Message.objects.filter(conversation_id=membership.conversation_id).exclude(
+            sender_id=membership.user_id
+        )
+        if last_read_id:
+            unread = unread.filter(id__gt=last_read_id)
+        ConversationMembership.objects.filter(pk=membership.pk).update(
+            last_read_message_id=last_read_id,
+            unread_count=unread.count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationmembership',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddField(
+            model_name='conversationmembership',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+    ]
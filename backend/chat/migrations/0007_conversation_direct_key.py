@@ -0,0 +1,49 @@
+# Generated by Django 5.0.9 on 2026-10-17 17:35
+
+from django.db import migrations, models
+
+
+def backfill_direct_keys(apps, schema_editor):
+    """
+    Key existing direct chats by their member pair.
+
+    Where duplicate DMs already exist for a pair, the oldest keeps the key and
+    becomes the one create-direct returns; the others stay reachable from the
+    inbox but are never matched again.
+    """
+    Conversation = apps.get_model('chat', 'Conversation')
+    ConversationMembership = apps.get_model('chat', 'ConversationMembership')
+
+    members = {}
+    for conversation_id, user_id in ConversationMembership.objects.filter(
+        conversation__conversation_type='direct'
+    ).values_list('conversation_id', 'user_id'):
+        members.setdefault(conversation_id, []).append(user_id)
+
+    seen = set()
+    for conversation_id in sorted(members):
+        user_ids = members[conversation_id]
+        if len(user_ids) not in (1, 2):
+            continue
+        low, high = min(user_ids), max(user_ids)
+        key = f"{low}:{high}"
+        if key in seen:
+            continue
+        seen.add(key)
+        Conversation.objects.filter(pk=conversation_id).update(direct_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='direct_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_direct_keys, migrations.RunPython.noop),
+    ]
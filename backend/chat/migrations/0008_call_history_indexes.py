@@ -0,0 +1,27 @@
+# Generated by Django 5.0.9 on 2026-10-17 17:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_conversation_direct_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['conversation', 'state', 'started_at'], name='chat_call_conv_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['state', 'started_at'], name='chat_call_state_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='callparticipant',
+            index=models.Index(fields=['user', 'call'], name='chat_callpart_user_call_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.9 on 2026-10-17 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_call_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
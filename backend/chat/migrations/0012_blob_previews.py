@@ -0,0 +1,50 @@
+# Generated by Django 5.0.9 on 2026-10-17 17:56
+
+import core.utils
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='blurhash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='previews_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='BlobPreview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variant', models.CharField(max_length=16)),
+                ('file', models.FileField(max_length=255, upload_to=core.utils.generate_preview_path)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('content_type', models.CharField(max_length=32)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='previews', to='chat.blob')),
+            ],
+            options={
+                'unique_together': {('blob', 'variant')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.9 on 2026-10-17 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_blob_previews'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attachment',
+            name='file_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
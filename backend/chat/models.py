@@ -1,8 +1,41 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
-from core.utils import generate_upload_path
+from core.utils import generate_blob_path, generate_preview_path, generate_upload_path
+
+
+def direct_pair_key(user_id, other_user_id):
+    """Canonical key for the direct conversation between two users, independent of who opens it."""
+    low, high = sorted((int(user_id), int(other_user_id)))
+    return f"{low}:{high}"
+
+
+class ConversationQuerySet(models.QuerySet):
+    def get_or_create_direct(self, user, other_user):
+        """
+        Return `(conversation, created)` for the direct chat between two users.
+
+        The lookup hits the unique `direct_key` index; concurrent requests for
+        the same pair race on that constraint, and the loser's get_or_create
+        falls back to fetching the winner's row.
+        """
+        with transaction.atomic():
+            conversation, created = self.get_or_create(
+                direct_key=direct_pair_key(user.id, other_user.id),
+                defaults={
+                    "title": f"{user.username} - {other_user.username}",
+                    "conversation_type": Conversation.DIRECT,
+                    "owner": user,
+                },
+            )
+            if created:
+                ConversationMembership.objects.create(conversation=conversation, user=user, is_admin=True)
+                if other_user.id != user.id:
+                    ConversationMembership.objects.create(conversation=conversation, user=other_user, is_admin=False)
+        return conversation, created
 
 
 class Conversation(models.Model):
@@ -24,11 +57,65 @@ class Conversation(models.Model):
     avatar = models.ImageField(upload_to=generate_upload_path, null=True, blank=True)
     is_public = models.BooleanField(default=False)
     invite_link = models.CharField(max_length=255, blank=True, unique=True, null=True)
+    # "<min_user_id>:<max_user_id>" for direct chats, NULL otherwise
+    direct_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    objects = ConversationQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.title or f"Conversation {self.pk}"
 
 
+class ConversationMembershipQuerySet(models.QuerySet):
+    def record_new_message(self, message):
+        """Bump unread counters for everyone but the sender, whose watermark moves to the message."""
+        members = self.filter(conversation_id=message.conversation_id)
+        members.exclude(user_id=message.sender_id).update(unread_count=F("unread_count") + 1)
+        members.filter(user_id=message.sender_id).update(last_read_message=message, unread_count=0)
+
+    def mark_read(self, conversation_id, user, message_id):
+        """
+        Advance a member's read watermark to `message_id` and recompute their unread count.
+
+        The watermark only moves forward, and the count is recomputed in the same
+        UPDATE so concurrent increments can never leave it drifting.
+        """
+        anchor = self._watermark_anchor(conversation_id, message_id).first()
+        if anchor is None:
+            return 0
+        members, values = self._watermark_update(conversation_id, user, *anchor)
+        return members.update(**values)
+
+    async def amark_read(self, conversation_id, user, message_id):
+        anchor = await self._watermark_anchor(conversation_id, message_id).afirst()
+        if anchor is None:
+            return 0
+        members, values = self._watermark_update(conversation_id, user, *anchor)
+        return await members.aupdate(**values)
+
+    def _watermark_anchor(self, conversation_id, message_id):
+        return Message.objects.filter(id=message_id, conversation_id=conversation_id).values_list("created_at", "id")
+
+    def _watermark_update(self, conversation_id, user, created_at, pk):
+        remaining = (
+            Message.objects.filter(conversation_id=OuterRef("conversation_id"))
+            .filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            .exclude(sender_id=user.id)
+            .order_by()
+            .values("conversation")
+            .annotate(total=Count("id"))
+            .values("total")
+        )
+        members = (
+            self.filter(conversation_id=conversation_id, user=user)
+            .filter(Q(last_read_message__isnull=True) | Q(last_read_message_id__lt=pk))
+        )
+        return members, {
+            "last_read_message_id": pk,
+            "unread_count": Coalesce(Subquery(remaining, output_field=models.IntegerField()), 0),
+        }
+
+
 class ConversationMembership(models.Model):
     conversation = models.ForeignKey(Conversation, related_name="memberships", on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="memberships", on_delete=models.CASCADE)
@@ -36,6 +123,12 @@ class ConversationMembership(models.Model):
     is_admin = models.BooleanField(default=False)
     joined_at = models.DateTimeField(default=timezone.now)
     muted_until = models.DateTimeField(null=True, blank=True)
+    last_read_message = models.ForeignKey(
+        "Message", null=True, blank=True, related_name="+", on_delete=models.SET_NULL
+    )
+    unread_count = models.PositiveIntegerField(default=0)
+
+    objects = ConversationMembershipQuerySet.as_manager()
 
     class Meta:
         unique_together = ("conversation", "user")
@@ -66,15 +159,79 @@ class Message(models.Model):
     is_deleted = models.BooleanField(default=False)
 
     class Meta:
-        ordering = ["-created_at"]
+        ordering = ["-created_at", "-id"]
+        indexes = [
+            models.Index(fields=["conversation", "created_at", "id"], name="chat_msg_conv_created_idx"),
+        ]
+
+
+class Blob(models.Model):
+    """
+    Stored file content, shared by every attachment with the same SHA-256.
+
+    `ref_count` is the number of attachments pointing at the blob; the blob and
+    its file are deleted when it drops to zero (see chat.blobs).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=generate_blob_path, max_length=255)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Filled in by the preview pipeline (chat.previews) for images and videos
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    blurhash = models.CharField(max_length=64, blank=True)
+    previews_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.sha256
+
+
+class BlobPreview(models.Model):
+    """A downscaled rendition of a blob: a thumbnail size or a video's poster frame."""
+    blob = models.ForeignKey(Blob, related_name="previews", on_delete=models.CASCADE)
+    variant = models.CharField(max_length=16)
+    file = models.FileField(upload_to=generate_preview_path, max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    content_type = models.CharField(max_length=32)
+
+    class Meta:
+        unique_together = ("blob", "variant")
 
 
 class Attachment(models.Model):
     message = models.ForeignKey(Message, related_name="attachments", on_delete=models.CASCADE)
+    # Attachments uploaded before blobs existed have no blob until first forwarded
+    blob = models.ForeignKey(Blob, related_name="attachments", null=True, blank=True, editable=False, on_delete=models.PROTECT)
     file = models.FileField(upload_to=generate_upload_path)
     file_name = models.CharField(max_length=255)
-    file_size = models.PositiveIntegerField(default=0)
+    file_size = models.PositiveBigIntegerField(default=0)
     mime_type = models.CharField(max_length=128, blank=True)
+    # Hex SHA-256 of the content; the download ETag
+    sha256 = models.CharField(max_length=64, blank=True, editable=False)
+
+
+class Upload(models.Model):
+    """
+    A resumable upload (see chat.uploads).
+
+    Chunks are stored as they arrive until `offset` reaches `file_size`;
+    finalizing verifies `sha256` and sets `blob`, which the upload holds one
+    reference on until it is attached to a message or expires.
+    """
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="uploads", on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    file_size = models.PositiveBigIntegerField()
+    mime_type = models.CharField(max_length=128, blank=True)
+    sha256 = models.CharField(max_length=64)
+    offset = models.PositiveBigIntegerField(default=0)
+    blob = models.ForeignKey(Blob, related_name="uploads", null=True, blank=True, on_delete=models.PROTECT)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["updated_at"], name="chat_upload_updated_idx")]
 
 
 class MessageReceipt(models.Model):
@@ -158,6 +315,14 @@ class Call(models.Model):
     started_at = models.DateTimeField(default=timezone.now)
     ended_at = models.DateTimeField(null=True, blank=True)
     duration = models.PositiveIntegerField(default=0, help_text="Duration in seconds")
+
+    class Meta:
+        indexes = [
+            # Per-conversation call log and live-call lookups
+            models.Index(fields=["conversation", "state", "started_at"], name="chat_call_conv_state_idx"),
+            # The timeout sweeper scans live states by age across all conversations
+            models.Index(fields=["state", "started_at"], name="chat_call_state_started_idx"),
+        ]
     
     def __str__(self):
         return f"{self.get_call_type_display()} call by {self.caller.username}"
@@ -172,6 +337,10 @@ class CallParticipant(models.Model):
     
     class Meta:
         unique_together = ("call", "user")
+        indexes = [
+            # Per-user call history, newest call first
+            models.Index(fields=["user", "call"], name="chat_callpart_user_call_idx"),
+        ]
 
 
 class Notification(models.Model):
@@ -0,0 +1,150 @@
+from django.db.models import Q
+from rest_framework import exceptions
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (created_at, id) for message history.
+
+    Pages are anchored on a message id via ``?before=<id>`` (older history) or
+    ``?after=<id>`` (newer messages), so each page is a single index range scan
+    instead of an OFFSET. Results are always returned newest first.
+    """
+
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = "page_size"
+    before_query_param = "before"
+    after_query_param = "after"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        before = self._get_anchor(queryset, request, self.before_query_param)
+        after = self._get_anchor(queryset, request, self.after_query_param)
+        if before and after:
+            raise exceptions.ValidationError("Use either 'before' or 'after', not both.")
+
+        self.direction = "after" if after else "before"
+        if after:
+            created_at, pk = after
+            queryset = queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            ).order_by("created_at", "id")
+        else:
+            if before:
+                created_at, pk = before
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )
+            queryset = queryset.order_by("-created_at", "-id")
+
+        page = list(queryset[: self.page_size + 1])
+        self.has_more = len(page) > self.page_size
+        page = page[: self.page_size]
+        if after:
+            page.reverse()
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "has_more": self.has_more,
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "has_more": {"type": "boolean"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        raw = request.query_params.get(self.page_size_query_param)
+        if raw is None:
+            return self.page_size
+        try:
+            size = int(raw)
+        except ValueError:
+            raise exceptions.ValidationError({self.page_size_query_param: "Must be an integer."})
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        """Link to older messages, anchored on the oldest message in this page."""
+        if not self.page or (self.direction == "before" and not self.has_more):
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.after_query_param)
+        return replace_query_param(url, self.before_query_param, self.page[-1].id)
+
+    def get_previous_link(self):
+        """Link to newer messages, anchored on the newest message in this page."""
+        if not self.page or (self.direction == "after" and not self.has_more):
+            return None
+        if self.direction == "before" and self.before_query_param not in self.request.query_params:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.before_query_param)
+        return replace_query_param(url, self.after_query_param, self.page[0].id)
+
+    def _get_anchor(self, queryset, request, param):
+        raw = request.query_params.get(param)
+        if raw is None:
+            return None
+        try:
+            anchor_id = int(raw)
+        except ValueError:
+            raise exceptions.ValidationError({param: "Must be a message id."})
+        anchor = queryset.filter(id=anchor_id).values_list("created_at", "id").first()
+        if anchor is None:
+            raise exceptions.NotFound(f"Message {anchor_id} not found in this conversation.")
+        return anchor
+
+
+class CallHistoryPagination(MessageKeysetPagination):
+    """
+    Keyset pagination for a user's call log, newest call first.
+
+    Rows are CallParticipant entries ordered by call id, so ``?before=<call_id>``
+    continues from the (user, call) index without an OFFSET or a join.
+    """
+
+    page_size = 30
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.direction = "before"
+        raw = request.query_params.get(self.before_query_param)
+        if raw is not None:
+            try:
+                queryset = queryset.filter(call_id__lt=int(raw))
+            except ValueError:
+                raise exceptions.ValidationError({self.before_query_param: "Must be a call id."})
+
+        page = list(queryset.order_by("-call_id")[: self.page_size + 1])
+        self.has_more = len(page) > self.page_size
+        self.page = page[: self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        """Link to older calls, anchored on the oldest call in this page."""
+        if not self.has_more:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.before_query_param, self.page[-1].call_id)
+
+    def get_previous_link(self):
+        return None
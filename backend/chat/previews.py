@@ -0,0 +1,161 @@
+"""
+Attachment previews.
+
+For every new image or video blob the pipeline records the dimensions and a
+BlurHash placeholder, and stores downscaled thumbnails (WebP where Pillow
+supports it, JPEG otherwise) at each of `CHAT_PREVIEW_SIZES`; videos also
+get a poster frame, extracted with ffmpeg when it is installed. Previews
+belong to the blob, so they are built once per distinct file however often
+it is forwarded.
+
+Work runs in Celery (`chat.tasks.generate_previews`) after the upload commits.
+With `CHAT_MEDIA_PIPELINE = "inline"`, or when the broker cannot be reached,
+it runs in-process instead.
+"""
+import io
+import shutil
+import subprocess
+import tempfile
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from core import blurhash
+from .models import Blob, BlobPreview
+
+PREVIEW_SIZES = getattr(settings, "CHAT_PREVIEW_SIZES", {"small": 160, "medium": 480, "large": 1080})
+MEDIA_PIPELINE = getattr(settings, "CHAT_MEDIA_PIPELINE", "celery")
+POSTER_VARIANT = "poster"
+FFMPEG_TIMEOUT = 60
+
+if features.check("webp"):
+    PREVIEW_FORMAT, PREVIEW_CONTENT_TYPE, PREVIEW_EXTENSION = "WEBP", "image/webp", "webp"
+else:
+    PREVIEW_FORMAT, PREVIEW_CONTENT_TYPE, PREVIEW_EXTENSION = "JPEG", "image/jpeg", "jpg"
+
+
+def preview_kind(mime_type):
+    if mime_type.startswith("image/"):
+        return "image"
+    if mime_type.startswith("video/"):
+        return "video"
+    return None
+
+
+def schedule_previews(attachments):
+    """Queue preview generation, after commit, for attachment blobs that have never been processed."""
+    kinds = {}
+    for attachment in attachments:
+        kind = preview_kind(attachment.mime_type or "")
+        if attachment.blob_id and kind:
+            kinds[attachment.blob_id] = kind
+    if not kinds:
+        return
+    for blob_id in Blob.objects.filter(pk__in=list(kinds), previews_at__isnull=True).values_list("pk", flat=True):
+        transaction.on_commit(partial(_dispatch, blob_id, kinds[blob_id]))
+
+
+def _dispatch(blob_id, kind):
+    if MEDIA_PIPELINE == "celery":
+        from .tasks import generate_previews
+        try:
+            generate_previews.apply_async((blob_id, kind), retry=False)
+            return
+        except Exception as exc:
+            print(f"[Media] Broker unavailable ({exc}); generating previews for blob {blob_id} in-process")
+    build_previews(blob_id, kind)
+
+
+def _open_image(blob):
+    with blob.file.open("rb") as handle:
+        image = Image.open(handle)
+        size = image.size
+        # JPEG can decode straight at a reduced scale, which is far cheaper for camera photos
+        image.draft("RGB", (max(PREVIEW_SIZES.values()),) * 2)
+        image.load()
+    return image, size
+
+
+def _poster_frame(blob):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None, None
+    with tempfile.NamedTemporaryFile() as local:
+        try:
+            path = blob.file.path
+        except NotImplementedError:
+            # Remote storage: ffmpeg needs a local copy
+            with blob.file.open("rb") as handle:
+                for chunk in handle.chunks():
+                    local.write(chunk)
+            local.flush()
+            path = local.name
+        for seek in ("1", "0"):  # Skip a black first frame when the clip is long enough
+            result = subprocess.run(
+                [ffmpeg, "-v", "error", "-ss", seek, "-i", path, "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"],
+                capture_output=True, timeout=FFMPEG_TIMEOUT,
+            )
+            if result.stdout:
+                image = Image.open(io.BytesIO(result.stdout))
+                image.load()
+                return image, image.size
+    return None, None
+
+
+def _encode(image, image_format):
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=80)
+    return output.getvalue()
+
+
+def _preview(blob, variant, image, image_format, content_type, extension):
+    preview = BlobPreview(
+        blob=blob, variant=variant, width=image.width, height=image.height, content_type=content_type
+    )
+    preview.file.save(f"{variant}.{extension}", ContentFile(_encode(image, image_format)), save=False)
+    return preview
+
+
+def build_previews(blob_id, kind):
+    """Generate previews for one blob; returns how many were stored. Each blob is processed once."""
+    # Claim the blob so duplicate tasks for the same content do nothing
+    if not Blob.objects.filter(pk=blob_id, previews_at__isnull=True).update(previews_at=timezone.now()):
+        return 0
+    blob = Blob.objects.get(pk=blob_id)
+    try:
+        image, size = _open_image(blob) if kind == "image" else _poster_frame(blob)
+    except (OSError, ValueError, Image.DecompressionBombError, subprocess.SubprocessError) as exc:
+        print(f"[Media] Cannot preview blob {blob_id}: {exc}")
+        return 0
+    if image is None:
+        return 0
+
+    with image:
+        # Orientation from EXIF is applied so previews and dimensions match what viewers see
+        oriented = ImageOps.exif_transpose(image)
+        if oriented.size != image.size:
+            size = size[::-1]
+        previews = []
+        if kind == "video":
+            poster = oriented.copy()
+            poster.thumbnail((max(PREVIEW_SIZES.values()),) * 2, Image.LANCZOS)
+            previews.append(_preview(blob, POSTER_VARIANT, poster, "JPEG", "image/jpeg", "jpg"))
+        for variant, edge in sorted(PREVIEW_SIZES.items(), key=lambda item: item[1]):
+            if max(size) <= edge and previews:
+                break  # Larger sizes would only repeat the original
+            thumbnail = oriented.copy()
+            thumbnail.thumbnail((edge, edge), Image.LANCZOS)
+            previews.append(_preview(blob, variant, thumbnail, PREVIEW_FORMAT, PREVIEW_CONTENT_TYPE, PREVIEW_EXTENSION))
+        placeholder = blurhash.encode(oriented)
+
+    BlobPreview.objects.bulk_create(previews, ignore_conflicts=True)
+    Blob.objects.filter(pk=blob_id).update(width=size[0], height=size[1], blurhash=placeholder)
+    return len(previews)
@@ -3,5 +3,6 @@ from django.urls import path
 from . import consumers
 
 websocket_urlpatterns = [
+    path("ws/chat/", consumers.UserConsumer.as_asgi()),
     path("ws/chat/<int:conversation_id>/", consumers.ConversationConsumer.as_asgi()),
 ]
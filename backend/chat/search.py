@@ -0,0 +1,152 @@
+"""
+Message full-text search and user directory search.
+
+PostgreSQL uses a GIN expression index over ``to_tsvector(content)``; SQLite
+(development) uses the ``chat_message_fts`` FTS5 table kept in sync by
+triggers. Both are created by migration 0006. Any other backend falls back to
+``icontains``.
+"""
+import html
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Case, Exists, IntegerField, OuterRef, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from accounts.models import normalize_phone
+
+SEARCH_CONFIG = getattr(settings, "CHAT_SEARCH_CONFIG", "simple")
+FTS_TABLE = "chat_message_fts"
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+# The database marks matches with private-use characters; the content is
+# escaped before they become tags, so message HTML is never passed through
+_MATCH_START = "\ue000"
+_MATCH_STOP = "\ue001"
+
+
+def _render_highlight(marked):
+    escaped = html.escape(marked)
+    return escaped.replace(_MATCH_START, HIGHLIGHT_START).replace(_MATCH_STOP, HIGHLIGHT_STOP)
+
+
+def message_search_vector():
+    # Must stay identical to the indexed expression in migration 0006
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector("content", config=SEARCH_CONFIG)
+
+
+def _search_query(query):
+    from django.contrib.postgres.search import SearchQuery
+    return SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+
+
+def _fts5_match(query):
+    """Quote every term so user input can never be parsed as FTS5 syntax; the last term matches as a prefix."""
+    terms = ['"%s"' % term.replace('"', '""') for term in query.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _fts5_hits(query):
+    sql = (
+        f"SELECT rowid, bm25({FTS_TABLE}), highlight({FTS_TABLE}, 0, %s, %s) "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_MATCH_START, _MATCH_STOP, _fts5_match(query)])
+        # bm25() is lower-is-better; flip it so higher rank means more relevant everywhere
+        return {row[0]: (-row[1], row[2]) for row in cursor.fetchall()}
+
+
+def filter_messages(queryset, query):
+    """Restrict `queryset` to messages matching `query`, keeping its ordering."""
+    if connection.vendor == "postgresql":
+        return queryset.annotate(search=message_search_vector()).filter(search=_search_query(query))
+    if connection.vendor == "sqlite":
+        matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [_fts5_match(query)])
+        return queryset.filter(id__in=matches)
+    return queryset.filter(Q(content__icontains=query))
+
+
+def ranked_search(queryset, query, limit=50):
+    """
+    Return up to `limit` messages from `queryset` matching `query`, best match first.
+
+    Each message gets `rank` and `highlight` attributes. `highlight` is the
+    HTML-escaped content with matched terms wrapped in <mark> tags.
+    """
+    queryset = queryset.filter(is_deleted=False)
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import SearchHeadline, SearchRank
+        search_query = _search_query(query)
+        vector = message_search_vector()
+        messages = list(
+            queryset.annotate(search=vector, rank=SearchRank(vector, search_query))
+            .filter(search=search_query)
+            .annotate(highlight=SearchHeadline(
+                "content", search_query, config=SEARCH_CONFIG,
+                start_sel=_MATCH_START, stop_sel=_MATCH_STOP,
+            ))
+            .order_by("-rank", "-created_at")[:limit]
+        )
+        for message in messages:
+            message.highlight = _render_highlight(message.highlight)
+        return messages
+
+    if connection.vendor == "sqlite":
+        hits = _fts5_hits(query)
+        messages = list(queryset.filter(id__in=list(hits)))
+        for message in messages:
+            rank, marked = hits[message.id]
+            message.rank, message.highlight = rank, _render_highlight(marked)
+        messages.sort(key=lambda m: (m.rank, m.created_at), reverse=True)
+        return messages[:limit]
+
+    messages = list(queryset.filter(content__icontains=query).order_by("-created_at")[:limit])
+    for message in messages:
+        message.rank, message.highlight = 0.0, html.escape(message.content)
+    return messages
+
+
+def search_users(query, viewer, limit=20):
+    """
+    Directory search over username, display name and phone number prefix.
+
+    On PostgreSQL the icontains filters are served by the trigram GIN indexes
+    over UPPER(username) and UPPER(display_name) from accounts migration 0003,
+    and phone numbers match by digit prefix on an indexed normalized column. Results put the viewer's contacts first,
+    then prefix matches, then closest trigram similarity.
+    """
+    from .models import Contact
+
+    User = get_user_model()
+    matches = Q(username__icontains=query) | Q(display_name__icontains=query)
+    digits = normalize_phone(query)
+    if len(digits) >= 3:
+        matches |= Q(phone_digits__startswith=digits)
+
+    prefix = Q(username__istartswith=query) | Q(display_name__istartswith=query)
+    if digits:
+        prefix |= Q(phone_digits__startswith=digits)
+
+    queryset = (
+        User.objects.filter(matches)
+        .exclude(id=viewer.id)
+        .annotate(
+            is_contact=Exists(Contact.objects.filter(owner=viewer, contact=OuterRef("pk"), is_blocked=False)),
+            prefix_match=Case(When(prefix, then=Value(1)), default=Value(0), output_field=IntegerField()),
+        )
+    )
+    ordering = ["-is_contact", "-prefix_match"]
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import TrigramSimilarity
+        from django.db.models.functions import Greatest
+        queryset = queryset.annotate(
+            similarity=Greatest(TrigramSimilarity("username", query), TrigramSimilarity("display_name", query))
+        )
+        ordering.append("-similarity")
+    ordering.append("username")
+    return queryset.order_by(*ordering)[:limit]
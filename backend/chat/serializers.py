@@ -1,25 +1,70 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Prefetch
+from django.urls import reverse
 from rest_framework import serializers
 
 from .models import (
     Attachment, Conversation, ConversationMembership, Message, 
     MessageReceipt, MessageReaction, Contact, PinnedMessage,
-    Call, CallParticipant
+    Call, CallParticipant, Upload
+)
+from accounts.serializers import UserSerializer, UserSummarySerializer
+from . import uploads
+from .blobs import create_attachments
+
+
+# Attachment prefetch that also covers the preview fields below
+ATTACHMENTS_PREFETCH = Prefetch(
+    "attachments", queryset=Attachment.objects.select_related("blob").prefetch_related("blob__previews")
 )
-from accounts.serializers import UserSerializer
 
 
 class AttachmentSerializer(serializers.ModelSerializer):
+    """
+    Image and video attachments also carry `width`, `height`, a `blurhash`
+    placeholder and `previews` (variant -> url and size) once the preview
+    pipeline has processed them; until then those are null / empty.
+    """
     download_url = serializers.SerializerMethodField()
+    width = serializers.SerializerMethodField()
+    height = serializers.SerializerMethodField()
+    blurhash = serializers.SerializerMethodField()
+    previews = serializers.SerializerMethodField()
     
     class Meta:
         model = Attachment
-        fields = ["id", "file", "file_name", "file_size", "mime_type", "download_url"]
+        fields = [
+            "id", "file", "file_name", "file_size", "mime_type", "download_url",
+            "width", "height", "blurhash", "previews",
+        ]
         read_only_fields = ["id"]
     
     def get_download_url(self, obj):
-        from django.urls import reverse
         return reverse('attachment-download', args=[obj.id])
 
+    def get_width(self, obj):
+        return obj.blob.width if obj.blob else None
+
+    def get_height(self, obj):
+        return obj.blob.height if obj.blob else None
+
+    def get_blurhash(self, obj):
+        return (obj.blob.blurhash or None) if obj.blob else None
+
+    def get_previews(self, obj):
+        if obj.blob is None:
+            return {}
+        return {
+            preview.variant: {
+                "url": reverse('attachment-preview', args=[obj.id, preview.variant]),
+                "width": preview.width,
+                "height": preview.height,
+            }
+            for preview in obj.blob.previews.all()
+        }
+
 
 class MessageReceiptSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
@@ -61,6 +106,13 @@ class MessageSerializer(serializers.ModelSerializer):
         write_only=True,
         required=False
     )
+    # Finished resumable uploads to attach (see chat.uploads)
+    upload_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        write_only=True,
+        required=False,
+        max_length=10,
+    )
 
     class Meta:
         model = Message
@@ -81,23 +133,31 @@ class MessageSerializer(serializers.ModelSerializer):
             "receipts",
             "reactions",
             "uploaded_files",  # For file uploads
+            "upload_ids",
         ]
         read_only_fields = ["id", "sender", "created_at", "edited_at", "conversation"]
 
+    def validate_upload_ids(self, value):
+        user = self.context["request"].user
+        finished = {
+            upload.pk: upload
+            for upload in Upload.objects.filter(owner=user, pk__in=value, blob__isnull=False)
+        }
+        missing = [upload_id for upload_id in value if upload_id not in finished]
+        if missing:
+            raise serializers.ValidationError(f"Unknown or unfinished uploads: {missing}")
+        return [finished[upload_id] for upload_id in dict.fromkeys(value)]
+
     def create(self, validated_data):
         uploaded_files = validated_data.pop('uploaded_files', [])
-        message = super().create(validated_data)
-        
-        # Create attachments from uploaded files
-        for file in uploaded_files:
-            Attachment.objects.create(
-                message=message,
-                file=file,
-                file_name=file.name,
-                file_size=file.size,
-                mime_type=file.content_type or 'application/octet-stream'
-            )
-        
+        finished_uploads = validated_data.pop('upload_ids', [])
+        with transaction.atomic():
+            message = super().create(validated_data)
+
+            # Identical files are stored once and shared (see chat.blobs)
+            create_attachments(message, uploaded_files)
+            uploads.attach_uploads(message, finished_uploads)
+
         return message
 
     def get_reply_to_message(self, obj):
@@ -118,13 +178,125 @@ class MessageSerializer(serializers.ModelSerializer):
         return None
 
 
+class UploadSerializer(serializers.ModelSerializer):
+    complete = serializers.SerializerMethodField()
+    chunk_size = serializers.SerializerMethodField()
+    expires_at = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Upload
+        fields = [
+            "id", "file_name", "file_size", "mime_type", "sha256",
+            "offset", "complete", "chunk_size", "created_at", "expires_at",
+        ]
+        read_only_fields = ["id", "offset", "created_at"]
+
+    def validate_file_size(self, value):
+        if not 0 < value <= uploads.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"file_size must be between 1 and {uploads.UPLOAD_MAX_SIZE} bytes.")
+        return value
+
+    def validate_sha256(self, value):
+        value = value.lower()
+        if len(value) != 64 or any(char not in "0123456789abcdef" for char in value):
+            raise serializers.ValidationError("sha256 must be 64 hex characters.")
+        return value
+
+    def get_complete(self, obj):
+        return obj.blob_id is not None
+
+    def get_chunk_size(self, obj):
+        return uploads.UPLOAD_CHUNK_SIZE
+
+    def get_expires_at(self, obj):
+        return uploads.expires_at(obj)
+
+
+def read_watermarks(conversation_id):
+    """(user id, last read message id) rows behind the compact `read` count; async callers iterate it with `async for`."""
+    return ConversationMembership.objects.filter(
+        conversation_id=conversation_id, last_read_message__isnull=False
+    ).values_list("user_id", "last_read_message_id")
+
+
+class MessageEventSerializer(serializers.ModelSerializer):
+    """
+    Compact message representation for sockets, history and inbox previews.
+
+    The sender is reduced to display fields, receipts to per-state counts and
+    reactions to emoji -> count. Callers should prefetch `attachments`,
+    `receipts` and `reactions`; MessageSerializer remains the full form.
+
+    Reads are counted from the members' `last_read_message` watermarks, loaded
+    once per conversation with a synchronous query; pass `read_watermarks`
+    ({conversation id: [(user id, last read id)]}) in the context to supply
+    them instead, as async code must.
+    """
+    sender = UserSummarySerializer(read_only=True)
+    attachments = AttachmentSerializer(many=True, read_only=True)
+    receipts = serializers.SerializerMethodField()
+    reactions = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = [
+            "id",
+            "conversation",
+            "sender",
+            "message_type",
+            "content",
+            "created_at",
+            "edited_at",
+            "reply_to",
+            "forwarded_from",
+            "is_deleted",
+            "attachments",
+            "receipts",
+            "reactions",
+        ]
+        read_only_fields = fields
+
+    def _read_watermarks(self, conversation_id):
+        supplied = self.context.get("read_watermarks") or {}
+        if conversation_id in supplied:
+            return supplied[conversation_id]
+        # Cached on the serializer, which a ListSerializer reuses for every message
+        loaded = self.__dict__.setdefault("_watermarks", {})
+        if conversation_id not in loaded:
+            loaded[conversation_id] = list(read_watermarks(conversation_id))
+        return loaded[conversation_id]
+
+    def get_receipts(self, obj):
+        delivered = sum(
+            1 for receipt in obj.receipts.all()
+            if receipt.user_id != obj.sender_id and receipt.state == MessageReceipt.DELIVERED
+        )
+        read = sum(
+            1 for user_id, last_read_id in self._read_watermarks(obj.conversation_id)
+            if user_id != obj.sender_id and last_read_id >= obj.id
+        )
+        return {MessageReceipt.DELIVERED: delivered, MessageReceipt.READ: read}
+
+    def get_reactions(self, obj):
+        return dict(Counter(reaction.emoji for reaction in obj.reactions.all()))
+
+
+class MessageSearchResultSerializer(MessageEventSerializer):
+    rank = serializers.FloatField(read_only=True)
+    highlight = serializers.CharField(read_only=True)
+
+    class Meta(MessageEventSerializer.Meta):
+        fields = MessageEventSerializer.Meta.fields + ["rank", "highlight"]
+        read_only_fields = fields
+
+
 class ConversationMembershipSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = ConversationMembership
-        fields = ["id", "user", "nickname", "is_admin", "joined_at", "muted_until"]
-        read_only_fields = ["id", "joined_at"]
+        fields = ["id", "user", "nickname", "is_admin", "joined_at", "muted_until", "last_read_message"]
+        read_only_fields = ["id", "joined_at", "last_read_message"]
 
 
 class PinnedMessageSerializer(serializers.ModelSerializer):
@@ -162,15 +334,27 @@ class ConversationSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "owner", "created_at", "updated_at"]
 
     def get_last_message(self, obj):
-        last_msg = obj.messages.filter(is_deleted=False).first()
+        # ConversationViewSet loads the latest message into `latest_messages`
+        if hasattr(obj, 'latest_messages'):
+            last_msg = obj.latest_messages[0] if obj.latest_messages else None
+        else:
+            last_msg = obj.messages.filter(is_deleted=False).first()
         if last_msg:
-            return MessageSerializer(last_msg).data
+            watermarks = [
+                (membership.user_id, membership.last_read_message_id)
+                for membership in obj.memberships.all()
+                if membership.last_read_message_id is not None
+            ]
+            return MessageEventSerializer(last_msg, context={"read_watermarks": {obj.pk: watermarks}}).data
         return None
 
     def get_unread_count(self, obj):
+        if hasattr(obj, 'unread_total'):
+            return obj.unread_total
         user = self.context.get('request').user if self.context.get('request') else None
         if user and user.is_authenticated:
-            return obj.messages.exclude(receipts__user=user, receipts__state='read').count()
+            membership = obj.memberships.filter(user=user).only('unread_count').first()
+            return membership.unread_count if membership else 0
         return 0
 
 
@@ -195,3 +379,27 @@ class CallSerializer(serializers.ModelSerializer):
             "started_at", "ended_at", "duration", "participants"
         ]
         read_only_fields = ["id", "caller", "started_at", "ended_at", "duration"]
+
+
+class CallHistorySerializer(serializers.ModelSerializer):
+    """One row of a user's call log, built from their CallParticipant entry"""
+    id = serializers.IntegerField(source="call_id", read_only=True)
+    conversation = serializers.IntegerField(source="call.conversation_id", read_only=True)
+    caller = UserSummarySerializer(source="call.caller", read_only=True)
+    call_type = serializers.CharField(source="call.call_type", read_only=True)
+    state = serializers.CharField(source="call.state", read_only=True)
+    started_at = serializers.DateTimeField(source="call.started_at", read_only=True)
+    ended_at = serializers.DateTimeField(source="call.ended_at", read_only=True)
+    duration = serializers.IntegerField(source="call.duration", read_only=True)
+    direction = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CallParticipant
+        fields = [
+            "id", "conversation", "caller", "call_type", "state", "started_at", "ended_at",
+            "duration", "direction", "is_answered", "joined_at", "left_at",
+        ]
+        read_only_fields = fields
+
+    def get_direction(self, obj):
+        return "outgoing" if obj.call.caller_id == obj.user_id else "incoming"
@@ -1,10 +1,42 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import Message, MessageReceipt
+from .blobs import release_blobs
+from .membership import invalidate_memberships
+from .models import Attachment, ConversationMembership, Message, MessageReceipt, Upload
+from .uploads import discard_chunks
 
 
 @receiver(post_save, sender=Message)
 def create_sender_receipt(sender, instance, created, **kwargs):
     if created:
         MessageReceipt.objects.get_or_create(message=instance, user=instance.sender, defaults={"state": MessageReceipt.SENT})
+
+
+@receiver(post_save, sender=Message)
+def update_unread_counters(sender, instance, created, **kwargs):
+    if created:
+        ConversationMembership.objects.record_new_message(instance)
+
+
+@receiver(post_save, sender=ConversationMembership)
+def membership_added(sender, instance, created, **kwargs):
+    if created:
+        invalidate_memberships(instance.user_id)
+
+
+@receiver(post_delete, sender=ConversationMembership)
+def membership_removed(sender, instance, **kwargs):
+    invalidate_memberships(instance.user_id)
+
+
+@receiver(post_delete, sender=Attachment)
+def attachment_deleted(sender, instance, **kwargs):
+    release_blobs([instance.blob_id])
+
+
+@receiver(post_delete, sender=Upload)
+def upload_deleted(sender, instance, **kwargs):
+    release_blobs([instance.blob_id])
+    transaction.on_commit(lambda: discard_chunks(instance.pk))
@@ -5,3 +5,24 @@ from celery import shared_task
 def send_push_notification(message_id: int) -> None:
     # Placeholder for async push notification dispatch
     return None
+
+
+@shared_task
+def sweep_stale_calls() -> int:
+    """Mark unanswered calls MISSED and end abandoned ones; scheduled by CELERY_BEAT_SCHEDULE."""
+    from .calls import sweep_calls
+    return sweep_calls()
+
+
+@shared_task
+def sweep_stale_uploads() -> int:
+    """Delete abandoned resumable uploads and their chunks; scheduled by CELERY_BEAT_SCHEDULE."""
+    from .uploads import sweep_uploads
+    return sweep_uploads()
+
+
+@shared_task
+def generate_previews(blob_id: int, kind: str) -> int:
+    """Build thumbnails, poster frame, dimensions and BlurHash for a new blob (see chat.previews)."""
+    from .previews import build_previews
+    return build_previews(blob_id, kind)
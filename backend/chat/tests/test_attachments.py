@@ -0,0 +1,185 @@
+import io
+import shutil
+import tempfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+
+from chat.models import Attachment, Blob, BlobPreview, Conversation, ConversationMembership, Message
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class AttachmentDownloadTests(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="sender", password="pass12345")
+        self.conversation = Conversation.objects.create(owner=self.user)
+        ConversationMembership.objects.create(conversation=self.conversation, user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+        self.content = bytes(range(256)) * 40
+        url = reverse("conversation-messages-list", kwargs={"conversation_pk": self.conversation.id})
+        response = self.client.post(url, {
+            "content": "clip",
+            "uploaded_files": [SimpleUploadedFile("clip.mp4", self.content, content_type="video/mp4")],
+        }, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        self.url = reverse("attachment-download", args=[response.data["attachments"][0]["id"]])
+
+    def test_full_download_carries_strong_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=100-199")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 100-199/{len(self.content)}")
+        self.assertEqual(b"".join(response.streaming_content), self.content[100:200])
+
+        tail = self.client.get(self.url, HTTP_RANGE="bytes=-10")
+        self.assertEqual(b"".join(tail.streaming_content), self.content[-10:])
+
+        stale = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(stale.status_code, 200)
+
+        beyond = self.client.get(self.url, HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(beyond.status_code, 416)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class AttachmentDeduplicationTests(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="sender", password="pass12345")
+        self.conversation = Conversation.objects.create(owner=self.user)
+        self.other = Conversation.objects.create(owner=self.user)
+        for conversation in (self.conversation, self.other):
+            ConversationMembership.objects.create(conversation=conversation, user=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def _upload(self, conversation, content, name="meme.gif"):
+        url = reverse("conversation-messages-list", kwargs={"conversation_pk": conversation.id})
+        response = self.client.post(url, {
+            "content": "look",
+            "uploaded_files": [SimpleUploadedFile(name, content, content_type="image/gif")],
+        }, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self._upload(self.conversation, b"GIF89a same bytes")
+        self._upload(self.other, b"GIF89a same bytes", name="renamed.gif")
+        self._upload(self.other, b"GIF89a other bytes")
+
+        self.assertEqual(Blob.objects.count(), 2)
+        shared = Blob.objects.get(sha256=Attachment.objects.get(pk=first["attachments"][0]["id"]).sha256)
+        self.assertEqual(shared.ref_count, 2)
+        self.assertEqual(
+            set(Attachment.objects.filter(blob=shared).values_list("file", flat=True)), {shared.file.name}
+        )
+        self.assertEqual(
+            set(Attachment.objects.filter(blob=shared).values_list("file_name", flat=True)), {"meme.gif", "renamed.gif"}
+        )
+
+    def test_forwarding_reuses_the_blob(self):
+        sent = self._upload(self.conversation, b"viral clip")
+        url = reverse(
+            "conversation-messages-forward", kwargs={"conversation_pk": self.conversation.id, "pk": sent["id"]}
+        )
+        response = self.client.post(url, {"conversation_id": self.other.id}, format="json")
+        self.assertEqual(response.status_code, 201)
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        forwarded = Attachment.objects.get(message_id=response.data["id"])
+        self.assertEqual(forwarded.blob_id, blob.id)
+        self.assertEqual(forwarded.file.name, blob.file.name)
+
+    def test_last_reference_deletes_the_blob(self):
+        self._upload(self.conversation, b"short lived")
+        self._upload(self.other, b"short lived")
+        blob = Blob.objects.get()
+        storage, name = blob.file.storage, blob.file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.filter(conversation=self.conversation).delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.filter(conversation=self.other).delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class AttachmentPreviewTests(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="sender", password="pass12345")
+        self.conversation = Conversation.objects.create(owner=self.user)
+        ConversationMembership.objects.create(conversation=self.conversation, user=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("conversation-messages-list", kwargs={"conversation_pk": self.conversation.id})
+
+    def _send(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"content": "pic", "uploaded_files": [upload]}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        return response.data["attachments"][0]["id"]
+
+    def test_image_gets_thumbnails_and_placeholder(self):
+        photo = io.BytesIO()
+        Image.linear_gradient("L").convert("RGB").resize((1600, 800)).save(photo, format="JPEG")
+        attachment_id = self._send(SimpleUploadedFile("photo.jpg", photo.getvalue(), content_type="image/jpeg"))
+
+        blob = Blob.objects.get()
+        self.assertEqual((blob.width, blob.height), (1600, 800))
+        self.assertEqual(len(blob.blurhash), 28)
+        self.assertEqual(set(blob.previews.values_list("variant", flat=True)), {"small", "medium", "large"})
+
+        listed = self.client.get(self.url).data["results"][0]["attachments"][0]
+        self.assertEqual(listed["width"], 1600)
+        self.assertEqual(listed["blurhash"], blob.blurhash)
+        self.assertEqual((listed["previews"]["small"]["width"], listed["previews"]["small"]["height"]), (160, 80))
+
+        response = self.client.get(listed["previews"]["small"]["url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], BlobPreview.objects.get(variant="small").content_type)
+        self.assertIn("immutable", response["Cache-Control"])
+        with Image.open(io.BytesIO(b"".join(response.streaming_content))) as thumbnail:
+            self.assertEqual(thumbnail.size, (160, 80))
+
+        missing = reverse("attachment-preview", args=[attachment_id, "poster"])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_other_files_are_left_alone(self):
+        self._send(SimpleUploadedFile("notes.txt", b"plain text", content_type="text/plain"))
+        blob = Blob.objects.get()
+        self.assertIsNone(blob.previews_at)
+        self.assertFalse(blob.previews.exists())
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+
+from chat import calls
+from chat.models import Call, CallParticipant, Conversation, ConversationMembership
+
+User = get_user_model()
+
+
+class CallLifecycleTests(APITestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username=name, password="pass12345") for name in ("alice", "bob", "carol")
+        ]
+        self.conversation = Conversation.objects.create(owner=self.alice, conversation_type=Conversation.GROUP)
+        for user in (self.alice, self.bob, self.carol):
+            ConversationMembership.objects.create(conversation=self.conversation, user=user)
+
+    def test_start_call_rings_every_other_member_in_one_insert(self):
+        with self.assertNumQueries(5):
+            call = calls.start_call(self.conversation.id, self.alice)
+        self.assertEqual(call.state, Call.RINGING)
+        self.assertEqual(call.participants.count(), 3)
+
+    def test_active_call_ends_when_second_to_last_person_leaves(self):
+        call = calls.start_call(self.conversation.id, self.alice)
+        self.assertEqual(calls.answer_call(call.id, self.bob), Call.ACTIVE)
+        self.assertEqual(calls.answer_call(call.id, self.carol), Call.ACTIVE)
+
+        self.assertEqual(calls.leave_call(call.id, self.carol), Call.ACTIVE)
+        self.assertEqual(calls.leave_call(call.id, self.alice), Call.ENDED)
+        # Already left, so a second hang-up is rejected rather than re-ending the call
+        self.assertIsNone(calls.leave_call(call.id, self.alice))
+        self.assertFalse(CallParticipant.objects.filter(call=call, left_at__isnull=True).exists())
+
+    def test_call_is_declined_once_nobody_is_left_ringing(self):
+        call = calls.start_call(self.conversation.id, self.alice, participant_ids=[self.bob.id, self.carol.id])
+        self.assertEqual(calls.decline_call(call.id, self.bob), Call.RINGING)
+        self.assertEqual(calls.decline_call(call.id, self.carol), Call.DECLINED)
+
+    def test_start_call_validates_participant_ids(self):
+        self.client.force_authenticate(user=self.alice)
+        url = reverse("call-list")
+        payload = {"conversation_id": self.conversation.id, "call_type": Call.VOICE}
+
+        response = self.client.post(url, {**payload, "participant_ids": ["x"]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {**payload, "participant_ids": self.bob.id}, format="json")
+        self.assertEqual(response.status_code, 201)
+        call = Call.objects.get(pk=response.data["id"])
+        self.assertEqual(set(call.participants.values_list("user_id", flat=True)), {self.alice.id, self.bob.id})
+
+    def test_sweeper_marks_unanswered_calls_missed_and_hides_zombies(self):
+        call = calls.start_call(self.conversation.id, self.alice)
+        later = timezone.now() + timedelta(seconds=calls.CALL_RING_TIMEOUT + 1)
+
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.get(reverse("call-active"))
+        self.assertEqual([c["id"] for c in response.data], [call.id])
+
+        self.assertEqual(calls.sweep_calls(now=later), 1)
+        call.refresh_from_db()
+        self.assertEqual(call.state, Call.MISSED)
+        self.assertEqual(calls.sweep_calls(now=later), 0)
+        self.assertIsNone(calls.answer_call(call.id, self.bob))
+        self.assertEqual(self.client.get(reverse("call-active")).data, [])
+
+    def test_call_history_is_keyset_paginated_from_participations(self):
+        started = [calls.start_call(self.conversation.id, caller) for caller in (self.alice, self.bob, self.alice)]
+        self.client.force_authenticate(user=self.bob)
+        url = reverse("call-history")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"page_size": 2})
+        self.assertEqual([row["id"] for row in response.data["results"]], [started[2].id, started[1].id])
+        self.assertEqual(
+            [row["direction"] for row in response.data["results"]], ["incoming", "outgoing"]
+        )
+        self.assertTrue(response.data["has_more"])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual([row["id"] for row in response.data["results"]], [started[0].id])
+        self.assertIsNone(response.data["next"])
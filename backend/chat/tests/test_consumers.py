@@ -0,0 +1,259 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from accounts.models import UserSettings
+from chat import consumers
+from chat.broadcast import frame_event
+from chat.models import Call, CallParticipant, Conversation, ConversationMembership, Message
+from chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+
+class TypingIndicatorTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username="alice", password="pass12345")
+        self.bob = User.objects.create_user(username="bob", password="pass12345")
+        self.conversation = Conversation.objects.create(owner=self.alice, conversation_type=Conversation.GROUP)
+        for user in (self.alice, self.bob):
+            ConversationMembership.objects.create(conversation=self.conversation, user=user)
+
+        timings = {"typing_interval": 0.2, "typing_timeout": 0.3, "typing_stop_grace": 0.05}
+        for name, value in timings.items():
+            original = getattr(consumers.ConversationConsumer, name)
+            setattr(consumers.ConversationConsumer, name, value)
+            self.addCleanup(setattr, consumers.ConversationConsumer, name, original)
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{self.conversation.id}/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def test_typing_bursts_are_throttled_and_expire(self):
+        async def scenario():
+            alice = await self._connect(self.alice)
+            bob = await self._connect(self.bob)
+            for _ in range(5):
+                await alice.send_json_to({"type": "typing", "is_typing": True})
+            start = await bob.receive_json_from()
+            self.assertTrue(start["is_typing"])
+            self.assertEqual(start["user_id"], self.alice.id)
+            self.assertTrue(await bob.receive_nothing(0.1))
+
+            # No stop from the client: the server expires the indicator itself
+            stop = await bob.receive_json_from(timeout=1)
+            self.assertFalse(stop["is_typing"])
+            self.assertTrue(await alice.receive_nothing(0.05))
+
+            # A stop immediately followed by a start is coalesced away
+            await alice.send_json_to({"type": "typing", "is_typing": True})
+            await bob.receive_json_from()
+            await alice.send_json_to({"type": "typing", "is_typing": False})
+            await alice.send_json_to({"type": "typing", "is_typing": True})
+            self.assertTrue(await bob.receive_nothing(0.1))
+
+            await alice.disconnect()
+            self.assertFalse((await bob.receive_json_from())["is_typing"])
+            await bob.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_typing_is_not_sent_for_users_who_hide_it(self):
+        UserSettings.objects.create(user=self.alice, show_typing_indicator=False)
+
+        async def scenario():
+            alice = await self._connect(self.alice)
+            bob = await self._connect(self.bob)
+            await alice.send_json_to({"type": "typing", "is_typing": True})
+            self.assertTrue(await bob.receive_nothing(0.1))
+            await alice.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(scenario)()
+
+
+class MessageEventTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username="alice", password="pass12345")
+        self.bob = User.objects.create_user(username="bob", password="pass12345")
+        self.conversation = Conversation.objects.create(owner=self.alice, conversation_type=Conversation.GROUP)
+        for user in (self.alice, self.bob):
+            ConversationMembership.objects.create(conversation=self.conversation, user=user)
+
+        original = consumers.ConversationConsumer.read_flush_delay
+        consumers.ConversationConsumer.read_flush_delay = 0.01
+        self.addCleanup(setattr, consumers.ConversationConsumer, "read_flush_delay", original)
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{self.conversation.id}/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def test_sent_and_edited_messages_are_broadcast(self):
+        async def scenario():
+            alice, bob = await self._connect(self.alice), await self._connect(self.bob)
+            await alice.send_json_to({"type": "message.send", "content": "Hello"})
+            new = await bob.receive_json_from()
+            self.assertEqual(new["type"], "message.new")
+            self.assertEqual(new["data"]["content"], "Hello")
+            self.assertEqual(new["data"]["receipts"], {"delivered": 0, "read": 0})
+            await alice.receive_json_from()
+
+            message_id = new["data"]["id"]
+            await ConversationMembership.objects.filter(user=self.bob).aupdate(last_read_message_id=message_id)
+            await alice.send_json_to({"type": "message.edit", "message_id": message_id, "content": "Hello, Bob"})
+            edited = await bob.receive_json_from()
+            self.assertEqual(edited["type"], "message.edited")
+            self.assertEqual(edited["data"]["content"], "Hello, Bob")
+            self.assertEqual(edited["data"]["receipts"]["read"], 1)
+            for communicator in (alice, bob):
+                await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_scalar_message_ids_are_accepted(self):
+        message = Message.objects.create(conversation=self.conversation, sender=self.alice, content="Hi")
+
+        async def scenario():
+            bob = await self._connect(self.bob)
+            await bob.send_json_to({"type": "message.read_up_to", "message_ids": message.id})
+            read = await bob.receive_json_from()
+            self.assertEqual((read["type"], read["message_id"]), ("message.read", message.id))
+            await bob.send_json_to({"type": "message.read_up_to", "message_ids": "latest"})
+            await bob.send_json_to({"type": "ping"})
+            self.assertEqual((await bob.receive_json_from())["type"], "pong")
+            await bob.disconnect()
+
+        async_to_sync(scenario)()
+
+
+class CallSignalingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username=name, password="pass12345") for name in ("alice", "bob", "carol")
+        ]
+        self.conversation = Conversation.objects.create(owner=self.alice, conversation_type=Conversation.GROUP)
+        for user in (self.alice, self.bob, self.carol):
+            ConversationMembership.objects.create(conversation=self.conversation, user=user)
+        self.call = Call.objects.create(conversation=self.conversation, caller=self.alice)
+        for user in (self.alice, self.bob):
+            CallParticipant.objects.create(call=self.call, user=user)
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/chat/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to({"type": "subscribe", "conversation_id": self.conversation.id})
+        await communicator.receive_json_from()
+        return communicator
+
+    def test_signaling_reaches_call_participants_only(self):
+        async def scenario():
+            alice, bob, carol = [await self._connect(user) for user in (self.alice, self.bob, self.carol)]
+            event = {"conversation_id": self.conversation.id, "call_id": self.call.id}
+            await alice.send_json_to({**event, "type": "webrtc.offer", "offer": {"sdp": "v=0"}})
+            offer = await bob.receive_json_from()
+            self.assertEqual(offer["offer"], {"sdp": "v=0"})
+
+            for index in range(3):
+                await alice.send_json_to({**event, "type": "webrtc.ice_candidate", "candidate": {"index": index}})
+            batch = await bob.receive_json_from()
+            self.assertEqual(batch["candidates"], [{"index": 0}, {"index": 1}, {"index": 2}])
+
+            # Members who are not on the call hear nothing, and nor does a non-participant signaling
+            await carol.send_json_to({**event, "type": "webrtc.offer", "offer": {}})
+            self.assertTrue(await carol.receive_nothing(0.1))
+            self.assertTrue(await bob.receive_nothing(0.1))
+            self.assertTrue(await alice.receive_nothing(0.05))
+            for communicator in (alice, bob, carol):
+                await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_signaling_skips_sockets_for_other_conversations(self):
+        other = Conversation.objects.create(owner=self.bob)
+        ConversationMembership.objects.create(conversation=other, user=self.bob)
+
+        async def scenario():
+            alice = await self._connect(self.alice)
+            bob_sockets = []
+            for conversation_id in (self.conversation.id, other.id):
+                communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{conversation_id}/")
+                communicator.scope["user"] = self.bob
+                self.assertTrue((await communicator.connect())[0])
+                bob_sockets.append(communicator)
+            bob_here, bob_elsewhere = bob_sockets
+
+            event = {"conversation_id": self.conversation.id, "call_id": self.call.id}
+            await alice.send_json_to({**event, "type": "webrtc.offer", "offer": {"sdp": "v=0"}})
+            self.assertEqual((await bob_here.receive_json_from())["offer"], {"sdp": "v=0"})
+            self.assertTrue(await bob_elsewhere.receive_nothing(0.1))
+
+            # A non-list `candidates` is one candidate, not a sequence of characters
+            await alice.send_json_to({**event, "type": "webrtc.ice_candidate", "candidates": "candidate:1"})
+            self.assertEqual((await bob_here.receive_json_from())["candidate"], "candidate:1")
+            for communicator in (alice, bob_here, bob_elsewhere):
+                await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_signaling_reaches_participants_who_join_later(self):
+        async def scenario():
+            alice, bob, carol = [await self._connect(user) for user in (self.alice, self.bob, self.carol)]
+            event = {"conversation_id": self.conversation.id, "call_id": self.call.id}
+            await alice.send_json_to({**event, "type": "webrtc.offer", "offer": {}})
+            await bob.receive_json_from()
+
+            # Carol answers: every socket drops its cached peers, so Alice's next offer reaches her
+            await carol.send_json_to({**event, "type": "call.answer"})
+            for communicator in (alice, bob, carol):
+                self.assertEqual((await communicator.receive_json_from())["type"], "call.answered")
+            await alice.send_json_to({**event, "type": "webrtc.offer", "offer": {"to": "all"}})
+            self.assertEqual((await carol.receive_json_from())["offer"], {"to": "all"})
+            await bob.receive_json_from()
+
+            # A target missing from the cached peers forces a reload
+            dave = await database_sync_to_async(User.objects.create_user)(username="dave", password="pass12345")
+            await database_sync_to_async(ConversationMembership.objects.create)(conversation=self.conversation, user=dave)
+            await database_sync_to_async(CallParticipant.objects.create)(call=self.call, user=dave)
+            dave_socket = await self._connect(dave)
+            await alice.send_json_to({**event, "type": "webrtc.offer", "offer": {"to": "dave"}, "target_user_id": dave.id})
+            self.assertEqual((await dave_socket.receive_json_from())["offer"], {"to": "dave"})
+            for communicator in (alice, bob, carol, dave_socket):
+                await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+
+class EchoSuppressionTests(TransactionTestCase):
+    def test_excluded_channel_is_never_woken(self):
+        async def scenario():
+            layer = get_channel_layer()
+            sender = await layer.new_channel()
+            receiver = await layer.new_channel()
+            await layer.group_add("conversation_1", sender)
+            await layer.group_add("conversation_1", receiver)
+            await layer.group_send("conversation_1", frame_event({"type": "typing"}, exclude_channels=[sender]))
+
+            event = await layer.receive(receiver)
+            self.assertNotIn("exclude_channels", event)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(sender), 0.05)
+
+        async_to_sync(scenario)()
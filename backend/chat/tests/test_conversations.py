@@ -0,0 +1,121 @@
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+
+from chat.membership import add_members, get_member_conversation_ids
+from chat.models import Conversation, ConversationMembership, Message
+
+User = get_user_model()
+
+
+class ConversationListTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="pass12345")
+        self.client.force_authenticate(user=self.user)
+
+    def _create_conversation(self):
+        other = User.objects.create_user(username=f"member{User.objects.count()}", password="pass12345")
+        conversation = Conversation.objects.create(owner=self.user, conversation_type=Conversation.GROUP)
+        ConversationMembership.objects.create(conversation=conversation, user=self.user, is_admin=True)
+        ConversationMembership.objects.create(conversation=conversation, user=other)
+        Message.objects.create(conversation=conversation, sender=other, content="first")
+        Message.objects.create(conversation=conversation, sender=other, content="latest")
+        return conversation
+
+    def _count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("conversation-list"))
+        self.assertEqual(response.status_code, 200)
+        # The last message is a per-conversation subquery, never a window over all messages
+        self.assertFalse(any("ROW_NUMBER" in query["sql"] for query in ctx.captured_queries))
+        return len(ctx.captured_queries), response
+
+    def test_inbox_query_count_does_not_grow_with_conversations(self):
+        self._create_conversation()
+        small, _ = self._count_list_queries()
+        for _ in range(4):
+            self._create_conversation()
+        large, response = self._count_list_queries()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.data), 5)
+        for conversation in response.data:
+            self.assertEqual(conversation["last_message"]["content"], "latest")
+            self.assertEqual(conversation["unread_count"], 2)
+
+    def test_unread_counter_follows_read_watermark(self):
+        conversation = self._create_conversation()
+        membership = ConversationMembership.objects.get(conversation=conversation, user=self.user)
+        self.assertEqual(membership.unread_count, 2)
+
+        first = conversation.messages.order_by("id").first()
+        url = reverse("conversation-mark-read", kwargs={"pk": conversation.id})
+        response = self.client.post(url, {"message_id": first.id})
+        self.assertEqual(response.data, {"last_read_message": first.id, "unread_count": 1})
+
+        self.assertEqual(self.client.post(url, {"message_id": "latest"}).status_code, 400)
+
+        Message.objects.create(conversation=conversation, sender=self.user, content="reply")
+        membership.refresh_from_db()
+        self.assertEqual(membership.unread_count, 0)
+        self.assertEqual(membership.last_read_message.content, "reply")
+
+    def test_create_direct_reuses_pair_from_either_side(self):
+        other = User.objects.create_user(username="friend", password="pass12345")
+        url = reverse("conversation-create-direct")
+        response = self.client.post(url, {"user_id": other.id})
+        self.assertEqual(response.status_code, 201)
+
+        self.client.force_authenticate(user=other)
+        again = self.client.post(url, {"user_id": self.user.id})
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data["id"], response.data["id"])
+
+        conversation = Conversation.objects.get(conversation_type=Conversation.DIRECT)
+        self.assertEqual(conversation.direct_key, f"{self.user.id}:{other.id}")
+        self.assertEqual(conversation.memberships.count(), 2)
+
+    def test_group_members_are_added_and_removed_in_bulk(self):
+        others = [User.objects.create_user(username=f"bulk{i}", password="pass12345") for i in range(5)]
+        ids = [user.id for user in others]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                reverse("conversation-list"),
+                {"title": "Team", "conversation_type": "group", "member_ids": ids[:3] + [999999]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 201)
+        conversation = Conversation.objects.get(pk=response.data["id"])
+        self.assertEqual(
+            set(conversation.memberships.values_list("user_id", flat=True)), {self.user.id, *ids[:3]}
+        )
+        self.assertLess(len(ctx.captured_queries), 30)
+
+        add_url = reverse("conversation-add-member", kwargs={"pk": conversation.id})
+        response = self.client.post(add_url, {"user_ids": ids}, format="json")
+        self.assertEqual(response.data["added"], ids[3:])
+
+        remove_url = reverse("conversation-remove-member", kwargs={"pk": conversation.id})
+        response = self.client.post(remove_url, {"user_ids": ids[:2]}, format="json")
+        self.assertEqual(response.data["removed"], ids[:2])
+        self.assertEqual(conversation.memberships.count(), 4)
+
+        # Removed members lose access straight away despite the cached membership set
+        self.client.force_authenticate(user=others[0])
+        response = self.client.get(reverse("conversation-messages-list", kwargs={"conversation_pk": conversation.id}))
+        self.assertEqual(response.data["results"], [])
+        response = self.client.post(remove_url, {"user_ids": [ids[4]]}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+    def test_membership_cache_is_dropped_again_on_commit(self):
+        conversation = self._create_conversation()
+        newcomer = User.objects.create_user(username="newcomer", password="pass12345")
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                add_members(conversation, [newcomer.id])
+                # A concurrent reader caching the pre-commit set inside the window
+                cache.set(f"chat:memberships:{newcomer.id}", frozenset())
+        self.assertIn(conversation.id, get_member_conversation_ids(newcomer.id))
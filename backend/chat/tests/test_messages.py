@@ -1,8 +1,10 @@
+import json
+
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
 
-from chat.models import Conversation, ConversationMembership
+from chat.models import Conversation, ConversationMembership, Message, MessageReaction
 
 User = get_user_model()
 
@@ -21,3 +23,75 @@ class MessageTests(APITestCase):
         response = self.client.post(url, {"content": "Hello"})
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data["content"], "Hello")
+
+    def test_history_is_keyset_paginated(self):
+        messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.user, content=f"m{i}")
+            for i in range(5)
+        ]
+        self.client.force_authenticate(user=self.user)
+        url = reverse("conversation-messages-list", kwargs={"conversation_pk": self.conversation.id})
+
+        response = self.client.get(url, {"page_size": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["id"] for m in response.data["results"]], [messages[4].id, messages[3].id])
+        self.assertTrue(response.data["has_more"])
+
+        response = self.client.get(url, {"page_size": 2, "before": messages[3].id})
+        self.assertEqual([m["id"] for m in response.data["results"]], [messages[2].id, messages[1].id])
+
+        response = self.client.get(url, {"page_size": 2, "after": messages[1].id})
+        self.assertEqual([m["id"] for m in response.data["results"]], [messages[3].id, messages[2].id])
+
+    def test_removed_member_loses_access(self):
+        url = reverse("conversation-messages-list", kwargs={"conversation_pk": self.conversation.id})
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.client.post(url, {"content": "Hi"}).status_code, 201)
+
+        ConversationMembership.objects.filter(conversation=self.conversation, user=self.other).delete()
+        self.assertEqual(self.client.post(url, {"content": "Still here?"}).status_code, 403)
+        self.assertEqual(self.client.get(url).data["results"], [])
+
+    def test_history_uses_compact_representation(self):
+        message = Message.objects.create(conversation=self.conversation, sender=self.user, content="Hello")
+        MessageReaction.objects.create(message=message, user=self.user, emoji="👍")
+        MessageReaction.objects.create(message=message, user=self.other, emoji="👍")
+        self.client.force_authenticate(user=self.user)
+        url = reverse("conversation-messages-list", kwargs={"conversation_pk": self.conversation.id})
+
+        compact = self.client.get(url).data["results"][0]
+        self.assertEqual(compact["reactions"], {"👍": 2})
+        self.assertEqual(compact["receipts"], {"delivered": 0, "read": 0})
+        self.assertEqual(set(compact["sender"]), {"id", "username", "display_name", "avatar"})
+        self.assertLess(len(json.dumps(compact)), 500)
+
+        ConversationMembership.objects.filter(conversation=self.conversation).update(last_read_message=message)
+        compact = self.client.get(url).data["results"][0]
+        self.assertEqual(compact["receipts"], {"delivered": 0, "read": 1})
+
+        full = self.client.get(url, {"expand": "full"}).data["results"][0]
+        self.assertIn("settings", full["sender"])
+        self.assertEqual(len(full["reactions"]), 2)
+
+    def test_search_is_indexed_ranked_and_scoped_to_memberships(self):
+        Message.objects.create(conversation=self.conversation, sender=self.user, content="deploy went fine")
+        Message.objects.create(conversation=self.conversation, sender=self.user, content="lunch?")
+        hidden = Conversation.objects.create(owner=self.other)
+        ConversationMembership.objects.create(conversation=hidden, user=self.other)
+        Message.objects.create(conversation=hidden, sender=self.other, content="deploy secrets")
+        self.client.force_authenticate(user=self.user)
+
+        url = reverse("conversation-messages-list", kwargs={"conversation_pk": self.conversation.id})
+        results = self.client.get(url, {"search": "deploy"}).data["results"]
+        self.assertEqual([m["content"] for m in results], ["deploy went fine"])
+
+        results = self.client.get(reverse("message-search"), {"q": "depl"}).data
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["highlight"], "<mark>deploy</mark> went fine")
+
+    def test_search_highlight_escapes_message_html(self):
+        Message.objects.create(conversation=self.conversation, sender=self.user, content='<img src=x onerror="x"> deploy')
+        self.client.force_authenticate(user=self.user)
+
+        results = self.client.get(reverse("message-search"), {"q": "deploy"}).data
+        self.assertEqual(results[0]["highlight"], "&lt;img src=x onerror=&quot;x&quot;&gt; <mark>deploy</mark>")
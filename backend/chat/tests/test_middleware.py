@@ -0,0 +1,33 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.middleware import get_user_from_token, invalidate_cached_user, token_user_cache
+
+User = get_user_model()
+
+
+class TokenUserCacheTests(TransactionTestCase):
+    def setUp(self):
+        token_user_cache.clear()
+        self.user = User.objects.create_user(username="socket", password="pass12345")
+        self.token = str(AccessToken.for_user(self.user))
+
+    def test_token_is_resolved_from_cache_after_first_handshake(self):
+        first = async_to_sync(get_user_from_token)(self.token)
+        self.assertEqual(first.id, self.user.id)
+
+        with self.assertNumQueries(0):
+            second = async_to_sync(get_user_from_token)(self.token)
+        self.assertEqual(second.username, "socket")
+        self.assertIsNot(first, second)
+
+    def test_invalidation_forces_a_fresh_lookup(self):
+        async_to_sync(get_user_from_token)(self.token)
+        invalidate_cached_user(self.user.id)
+        self.assertIsNone(token_user_cache.get(self.token))
+
+    def test_invalid_token_is_anonymous(self):
+        user = async_to_sync(get_user_from_token)("not-a-token")
+        self.assertTrue(user.is_anonymous)
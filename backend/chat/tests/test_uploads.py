@@ -0,0 +1,106 @@
+import hashlib
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from chat.models import Attachment, Blob, Conversation, ConversationMembership, Upload
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ResumableUploadTests(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="sender", password="pass12345")
+        self.conversation = Conversation.objects.create(owner=self.user)
+        ConversationMembership.objects.create(conversation=self.conversation, user=self.user)
+        self.client.force_authenticate(user=self.user)
+        self.content = b"0123456789" * 100
+
+    def _init(self, content, sha256=None):
+        response = self.client.post(reverse("upload-list"), {
+            "file_name": "video.mp4",
+            "file_size": len(content),
+            "mime_type": "video/mp4",
+            "sha256": sha256 or hashlib.sha256(content).hexdigest(),
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def _put(self, upload_id, start, data, total=None):
+        return self.client.put(
+            reverse("upload-chunk", args=[upload_id]),
+            data=data,
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{start + len(data) - 1}/{total or len(self.content)}",
+        )
+
+    def test_chunks_resume_and_attach(self):
+        upload_id = self._init(self.content)
+        self.assertEqual(self._put(upload_id, 0, self.content[:400]).data["offset"], 400)
+
+        # A retry of a chunk the server already has is rejected with the real offset
+        conflict = self._put(upload_id, 0, self.content[:400])
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict["Upload-Offset"], "400")
+
+        status_response = self.client.get(reverse("upload-detail", args=[upload_id]))
+        self.assertEqual(status_response.data["offset"], 400)
+        self.assertFalse(status_response.data["complete"])
+
+        incomplete = self.client.post(reverse("upload-finalize", args=[upload_id]))
+        self.assertEqual(incomplete.status_code, 400)
+
+        self.assertEqual(self._put(upload_id, 400, self.content[400:]).data["offset"], len(self.content))
+        finalized = self.client.post(reverse("upload-finalize", args=[upload_id]))
+        self.assertEqual(finalized.status_code, 200)
+        self.assertTrue(finalized.data["complete"])
+
+        url = reverse("conversation-messages-list", kwargs={"conversation_pk": self.conversation.id})
+        response = self.client.post(url, {"content": "clip", "upload_ids": [upload_id]}, format="json")
+        self.assertEqual(response.status_code, 201)
+
+        attachment = Attachment.objects.get(message_id=response.data["id"])
+        self.assertEqual(attachment.file_name, "video.mp4")
+        with attachment.file.open("rb") as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+        # An upload can only be attached once
+        again = self.client.post(url, {"content": "again", "upload_ids": [upload_id]}, format="json")
+        self.assertEqual(again.status_code, 400)
+
+    def test_checksum_mismatch_restarts_upload(self):
+        upload_id = self._init(self.content, sha256="0" * 64)
+        self._put(upload_id, 0, self.content)
+
+        response = self.client.post(reverse("upload-finalize", args=[upload_id]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Upload.objects.get(pk=upload_id).offset, 0)
+        self.assertFalse(Blob.objects.exists())
+
+    def test_uploads_are_private_to_their_owner(self):
+        upload_id = self._init(self.content)
+        self._put(upload_id, 0, self.content)
+        self.client.post(reverse("upload-finalize", args=[upload_id]))
+
+        other = User.objects.create_user(username="other", password="pass12345")
+        ConversationMembership.objects.create(conversation=self.conversation, user=other)
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(reverse("upload-detail", args=[upload_id])).status_code, 404)
+
+        url = reverse("conversation-messages-list", kwargs={"conversation_pk": self.conversation.id})
+        response = self.client.post(url, {"content": "mine", "upload_ids": [upload_id]}, format="json")
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,31 @@
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+
+from chat.models import Contact
+
+User = get_user_model()
+
+
+class UserSearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="viewer", password="pass12345")
+        self.client.force_authenticate(user=self.user)
+
+    def _search(self, query):
+        response = self.client.get(reverse("user-search"), {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [user["username"] for user in response.data]
+
+    def test_contacts_then_prefix_matches_come_first(self):
+        User.objects.create_user(username="alexander", password="pass12345")
+        User.objects.create_user(username="xalex", password="pass12345")
+        friend = User.objects.create_user(username="old_alex_friend", password="pass12345")
+        Contact.objects.create(owner=self.user, contact=friend)
+
+        self.assertEqual(self._search("alex"), ["old_alex_friend", "alexander", "xalex"])
+
+    def test_phone_matches_by_normalized_prefix(self):
+        User.objects.create_user(username="dialed", password="pass12345", phone_number="+91 98765-43210")
+        self.assertEqual(self._search("+91987"), ["dialed"])
+        self.assertEqual(self._search("43210"), [])
@@ -0,0 +1,167 @@
+"""
+Resumable chunked uploads.
+
+    POST /chat/uploads/                      declare name, size, type and SHA-256
+    PUT  /chat/uploads/<id>/chunk/           Content-Range: bytes <start>-<end>/<size>
+    GET  /chat/uploads/<id>/                 current offset, to resume after a drop
+    POST /chat/uploads/<id>/finalize/        verify the checksum and store the blob
+
+Each chunk is written to storage as its own object when it arrives, so no
+request ever holds more than one chunk and a dropped connection loses at most
+the chunk in flight. Finalizing assembles the chunks, checks the SHA-256 and
+hands the content to chat.blobs; the finished upload is then attached to a
+message by passing its id in `upload_ids`. Uploads untouched for
+`CHAT_UPLOAD_EXPIRY` seconds are deleted by `sweep_uploads`.
+"""
+import hashlib
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import exceptions
+
+from .blobs import add_refs, store_blob
+from .models import Attachment, Upload
+from .previews import schedule_previews
+
+UPLOAD_CHUNK_SIZE = getattr(settings, "CHAT_UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024)
+UPLOAD_MAX_CHUNK_SIZE = getattr(settings, "CHAT_UPLOAD_MAX_CHUNK_SIZE", 16 * 1024 * 1024)
+UPLOAD_MAX_SIZE = getattr(settings, "CHAT_UPLOAD_MAX_SIZE", 2 * 1024 * 1024 * 1024)
+UPLOAD_EXPIRY = getattr(settings, "CHAT_UPLOAD_EXPIRY", 24 * 60 * 60)
+
+
+def _chunk_dir(upload_id):
+    return f"partial/{upload_id}"
+
+
+def _chunk_name(upload_id, offset):
+    # Zero-padded so that name order is offset order
+    return f"{_chunk_dir(upload_id)}/{offset:015d}"
+
+
+def expires_at(upload):
+    return upload.updated_at + timedelta(seconds=UPLOAD_EXPIRY)
+
+
+def write_chunk(upload, offset, data):
+    """
+    Store `data` at `offset` and return the new offset.
+
+    Returns None without writing anything if `offset` is not where the upload
+    currently ends, or the chunk would run past the declared size; the client
+    should resume from the upload's offset.
+    """
+    with transaction.atomic():
+        # Serializes chunks for one upload so a retried PUT cannot race the original
+        locked = Upload.objects.select_for_update().get(pk=upload.pk)
+        if locked.blob_id or offset != locked.offset or offset + len(data) > locked.file_size:
+            upload.offset = locked.offset
+            return None
+        name = _chunk_name(upload.pk, offset)
+        if default_storage.exists(name):
+            # Written by an earlier attempt whose offset was never recorded
+            default_storage.delete(name)
+        default_storage.save(name, ContentFile(data))
+        upload.offset, upload.updated_at = offset + len(data), timezone.now()
+        Upload.objects.filter(pk=upload.pk).update(offset=upload.offset, updated_at=upload.updated_at)
+    return upload.offset
+
+
+def _assemble(upload_id, destination):
+    """Copy the chunks in order into `destination`; returns the hex SHA-256 and total length."""
+    digest = hashlib.sha256()
+    length = 0
+    _, names = default_storage.listdir(_chunk_dir(upload_id))
+    for name in sorted(names):
+        if int(name) != length:
+            break  # A gap: the checksum cannot match
+        with default_storage.open(f"{_chunk_dir(upload_id)}/{name}", "rb") as chunk:
+            for data in chunk.chunks():
+                digest.update(data)
+                destination.write(data)
+                length += len(data)
+    return digest.hexdigest(), length
+
+
+def finalize(upload):
+    """
+    Verify the completed upload against its declared SHA-256 and store it as a blob.
+
+    Finalizing twice is harmless. On a checksum mismatch the chunks are
+    discarded and the upload restarts from offset 0.
+    """
+    with transaction.atomic():
+        locked = Upload.objects.select_for_update().get(pk=upload.pk)
+        if locked.blob_id:
+            return locked
+        if locked.offset != locked.file_size:
+            raise exceptions.ValidationError({"detail": "Upload is incomplete.", "offset": locked.offset})
+        with tempfile.TemporaryFile() as assembled:
+            digest, length = _assemble(locked.pk, assembled)
+            if digest == locked.sha256 and length == locked.file_size:
+                content = File(assembled, name=locked.file_name)
+                content.size = length
+                locked.blob = store_blob(content, sha256=digest)
+                add_refs([locked.blob.pk])
+                locked.updated_at = timezone.now()
+                locked.save(update_fields=["blob", "updated_at"])
+                transaction.on_commit(lambda: discard_chunks(locked.pk))
+                return locked
+        Upload.objects.filter(pk=locked.pk).update(offset=0, updated_at=timezone.now())
+    discard_chunks(locked.pk)
+    raise exceptions.ValidationError({"detail": "Checksum mismatch; upload the file again.", "offset": 0})
+
+
+def discard_chunks(upload_id):
+    try:
+        _, names = default_storage.listdir(_chunk_dir(upload_id))
+    except FileNotFoundError:
+        return
+    for name in names:
+        default_storage.delete(f"{_chunk_dir(upload_id)}/{name}")
+
+
+def attach_uploads(message, uploads):
+    """
+    Attach finished `uploads` to `message`, consuming them.
+
+    The attachments take over each upload's reference on its blob. Raises
+    ValidationError if an upload was consumed concurrently.
+    """
+    with transaction.atomic():
+        locked = list(
+            Upload.objects.select_for_update().select_related("blob").filter(pk__in=[upload.pk for upload in uploads])
+        )
+        if len(locked) != len(uploads):
+            raise exceptions.ValidationError({"upload_ids": ["Upload already used."]})
+        by_id = {upload.pk: upload for upload in locked}
+        attachments = [
+            Attachment(
+                message=message,
+                blob_id=upload.blob_id,
+                file=upload.blob.file.name,
+                file_name=upload.file_name,
+                file_size=upload.file_size,
+                mime_type=upload.mime_type or "application/octet-stream",
+                sha256=upload.sha256,
+            )
+            for upload in (by_id[upload.pk] for upload in uploads)
+        ]
+        Attachment.objects.bulk_create(attachments)
+        add_refs([attachment.blob_id for attachment in attachments])
+        schedule_previews(attachments)
+        # Deleting the uploads releases their references (see chat.signals)
+        Upload.objects.filter(pk__in=list(by_id)).delete()
+    return attachments
+
+
+def sweep_uploads(now=None):
+    """Delete uploads that have not been touched within CHAT_UPLOAD_EXPIRY; returns how many."""
+    now = now or timezone.now()
+    deleted, _ = Upload.objects.filter(updated_at__lt=now - timedelta(seconds=UPLOAD_EXPIRY)).delete()
+    return deleted
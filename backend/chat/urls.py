@@ -2,12 +2,16 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested.routers import NestedDefaultRouter
 
-from .views import ConversationViewSet, MessageViewSet, ContactViewSet, UserSearchViewSet, download_attachment, CallViewSet
+from .views import (
+    ConversationViewSet, MessageViewSet, ContactViewSet, UserSearchViewSet, MessageSearchViewSet,
+    download_attachment, attachment_preview, CallViewSet, UploadViewSet
+)
 
 router = DefaultRouter()
 router.register(r"conversations", ConversationViewSet, basename="conversation")
 router.register(r"contacts", ContactViewSet, basename="contact")
 router.register(r"calls", CallViewSet, basename="call")
+router.register(r"uploads", UploadViewSet, basename="upload")
 
 # Nested router for messages under conversations
 conversations_router = NestedDefaultRouter(router, r'conversations', lookup='conversation')
@@ -15,11 +19,14 @@ conversations_router.register(r'messages', MessageViewSet, basename='conversatio
 
 # User search viewset
 user_search_list = UserSearchViewSet.as_view({'get': 'list'})
+message_search_list = MessageSearchViewSet.as_view({'get': 'list'})
 
 urlpatterns = [
     path("", include(router.urls)),
     path("", include(conversations_router.urls)),
     path("users/search/", user_search_list, name="user-search"),
+    path("messages/search/", message_search_list, name="message-search"),
     path("attachments/<int:attachment_id>/download/", download_attachment, name="attachment-download"),
+    path("attachments/<int:attachment_id>/previews/<slug:variant>/", attachment_preview, name="attachment-preview"),
 ]
 
@@ -1,55 +1,96 @@
-from django.db import models
-from django.db.models import Q, Count
+import re
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.http import Http404
-from django.shortcuts import get_object_or_404
+from django.shortcuts import get_object_or_404, redirect
 from django.utils import timezone
 from rest_framework import exceptions, mixins, permissions, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
+from accounts.presence import PresenceMixin
+from core.media import serve_file
+from core.utils import file_sha256
 from .models import (
-    Conversation, ConversationMembership, Message, 
+    Conversation, ConversationMembership, Message,
     MessageReaction, Contact, PinnedMessage, Attachment,
-    Call, CallParticipant
+    Call, CallParticipant, Upload
 )
 from .serializers import (
-    ConversationSerializer, MessageSerializer, 
+    ConversationSerializer, MessageSerializer, MessageEventSerializer, MessageSearchResultSerializer,
     MessageReactionSerializer, ContactSerializer, PinnedMessageSerializer,
-    CallSerializer
+    CallSerializer, CallHistorySerializer, UploadSerializer, ATTACHMENTS_PREFETCH
 )
+from . import calls, uploads
+from .blobs import share_attachments
+from .broadcast import broadcast_to_conversation, notify_call_peers_changed
+from .membership import add_members, get_member_conversation_ids, is_member, remove_members
+from .pagination import CallHistoryPagination, MessageKeysetPagination
+from .search import filter_messages, ranked_search, search_users
 
 User = get_user_model()
 
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(PresenceMixin, viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def presence_users(self, conversations):
+        return [membership.user for conversation in conversations for membership in conversation.memberships.all()]
+
     def get_queryset(self):
         user = self.request.user
-        return Conversation.objects.filter(memberships__user=user).distinct()
+        # Memberships are unique per (conversation, user), so no DISTINCT is needed.
+        # Everything the serializer touches is annotated or prefetched up front so
+        # the inbox renders in a fixed number of queries regardless of its size.
+        unread = ConversationMembership.objects.filter(conversation=OuterRef("pk"), user=user).values("unread_count")[:1]
+        # One index probe per conversation on (conversation, created_at, id); the
+        # messages themselves are loaded by id in get_serializer
+        last_message = (
+            Message.objects.filter(conversation=OuterRef("pk"), is_deleted=False)
+            .order_by("-created_at", "-id")
+            .values("id")[:1]
+        )
+        return (
+            Conversation.objects.filter(memberships__user=user)
+            .annotate(
+                unread_total=Coalesce(Subquery(unread, output_field=IntegerField()), 0),
+                last_message_id=Subquery(last_message),
+            )
+            .prefetch_related(
+                Prefetch("memberships", queryset=ConversationMembership.objects.select_related("user__settings")),
+            )
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        if args and args[0] is not None:
+            self._attach_latest_messages(args[0] if kwargs.get("many") else [args[0]])
+        return super().get_serializer(*args, **kwargs)
+
+    def _attach_latest_messages(self, conversations):
+        """Load every annotated last message in one query and hang it on `latest_messages`."""
+        conversations = [conversation for conversation in conversations if hasattr(conversation, "last_message_id")]
+        message_ids = [conversation.last_message_id for conversation in conversations if conversation.last_message_id]
+        messages = {}
+        if message_ids:
+            messages = Message.objects.filter(id__in=message_ids).select_related("sender").prefetch_related(
+                ATTACHMENTS_PREFETCH, "receipts", "reactions"
+            ).in_bulk()
+        for conversation in conversations:
+            message = messages.get(conversation.last_message_id)
+            conversation.latest_messages = [message] if message else []
 
     def perform_create(self, serializer):
-        conversation = serializer.save(owner=self.request.user)
-        # Add creator as admin
-        ConversationMembership.objects.create(conversation=conversation, user=self.request.user, is_admin=True)
-        
-        # Add other members from request
-        member_ids = self.request.data.get("member_ids", [])
-        for user_id in member_ids:
-            try:
-                ConversationMembership.objects.get_or_create(
-                    conversation=conversation,
-                    user_id=int(user_id),
-                    defaults={'is_admin': False}
-                )
-            except Exception as e:
-                print(f"Failed to add member {user_id}: {e}")
+        member_ids = _parse_user_ids(self.request.data.get("member_ids", []))
+        with transaction.atomic():
+            conversation = serializer.save(owner=self.request.user)
+            # Add creator as admin
+            add_members(conversation, [self.request.user.id], is_admin=True)
+            add_members(conversation, set(member_ids) - {self.request.user.id})
 
     @action(detail=False, methods=["post"], url_path="create-direct")
     def create_direct(self, request):
@@ -70,41 +111,12 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 print(f"[create_direct] User not found: {other_user_id}")
                 return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
             
-            # Check for existing direct conversation
-            existing = Conversation.objects.filter(
-                conversation_type=Conversation.DIRECT,
-                memberships__user=request.user
-            ).filter(
-                memberships__user=other_user
-            ).annotate(
-                member_count=Count('memberships')
-            ).filter(member_count=2).first()
-            
-            if existing:
-                print(f"[create_direct] Found existing conversation: {existing.id}")
-                serializer = self.get_serializer(existing)
+            conversation, created = Conversation.objects.get_or_create_direct(request.user, other_user)
+            if not created:
+                print(f"[create_direct] Found existing conversation: {conversation.id}")
+                serializer = self.get_serializer(conversation)
                 return Response(serializer.data)
-            
-            # Create new conversation
-            print(f"[create_direct] Creating new conversation")
-            conversation = Conversation.objects.create(
-                title=f"{request.user.username} - {other_user.username}",
-                conversation_type=Conversation.DIRECT,
-                owner=request.user
-            )
-            
-            # Add both users
-            ConversationMembership.objects.create(
-                conversation=conversation,
-                user=request.user,
-                is_admin=True
-            )
-            ConversationMembership.objects.create(
-                conversation=conversation,
-                user=other_user,
-                is_admin=False
-            )
-            
+
             print(f"[create_direct] Conversation created: {conversation.id}")
             serializer = self.get_serializer(conversation)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -118,36 +130,99 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=True, methods=["post"], url_path="mark-read")
+    def mark_read(self, request, pk=None):
+        """Move the current user's read watermark forward to message_id"""
+        conversation = self.get_object()
+        message_id = request.data.get("message_id")
+        if not message_id:
+            return Response({"detail": "message_id required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return Response({"detail": "message_id must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        ConversationMembership.objects.mark_read(conversation.id, request.user, message_id)
+        membership = conversation.memberships.get(user=request.user)
+        return Response({
+            "last_read_message": membership.last_read_message_id,
+            "unread_count": membership.unread_count,
+        })
+
     @action(detail=True, methods=["post"], url_path="add-member")
     def add_member(self, request, pk=None):
+        """Add one user (`user_id`) or many (`user_ids`) to the conversation"""
+        conversation = self.get_object()
+        user_ids = _requested_user_ids(request)
+        if not user_ids:
+            return Response({"detail": "user_id or user_ids required."}, status=400)
+        added = add_members(conversation, user_ids)
+        return Response({"status": "member added", "added": added})
+
+    @action(detail=True, methods=["post"], url_path="remove-member")
+    def remove_member(self, request, pk=None):
+        """Remove one user (`user_id`) or many (`user_ids`); removing others requires admin rights"""
         conversation = self.get_object()
-        user_id = request.data.get("user_id")
-        if not user_id:
-            return Response({"detail": "user_id required."}, status=400)
-        ConversationMembership.objects.get_or_create(conversation=conversation, user_id=user_id)
-        return Response({"status": "member added"})
+        user_ids = _requested_user_ids(request)
+        if not user_ids:
+            return Response({"detail": "user_id or user_ids required."}, status=400)
+        if set(user_ids) != {request.user.id} and not conversation.memberships.filter(
+            user=request.user, is_admin=True
+        ).exists():
+            raise exceptions.PermissionDenied("Only admins can remove other members.")
+        removed = remove_members(conversation, user_ids)
+        return Response({"status": "members removed", "removed": removed})
+
+
+def _parse_user_ids(values):
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        raise exceptions.ValidationError({"detail": "User ids must be integers."})
+
+
+def _requested_user_ids(request):
+    if "user_ids" in request.data:
+        return _parse_user_ids(request.data.get("user_ids"))
+    user_id = request.data.get("user_id")
+    return _parse_user_ids(user_id) if user_id else []
 
 
 class MessageViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageKeysetPagination
 
     def get_queryset(self):
         user = self.request.user
         conversation_id = self.kwargs.get("conversation_pk")
-        qs = Message.objects.filter(conversation_id=conversation_id, conversation__memberships__user=user)
-        search = self.request.query_params.get("search")
+        if not is_member(user.id, conversation_id):
+            return Message.objects.none()
+        qs = Message.objects.filter(conversation_id=conversation_id)
+        search = self.request.query_params.get("search", "").strip()
         if search:
-            qs = qs.filter(Q(content__icontains=search))
-        return qs.select_related("sender", "conversation").prefetch_related("attachments", "receipts")
+            qs = filter_messages(qs, search)
+        if self._wants_full_messages():
+            return qs.select_related(
+                "sender__settings", "reply_to__sender__settings", "forwarded_from__sender__settings"
+            ).prefetch_related(ATTACHMENTS_PREFETCH, "receipts__user__settings", "reactions__user__settings")
+        return qs.select_related("sender").prefetch_related(ATTACHMENTS_PREFETCH, "receipts", "reactions")
+
+    def get_serializer_class(self):
+        if self.action == "list" and not self._wants_full_messages():
+            return MessageEventSerializer
+        return MessageSerializer
+
+    def _wants_full_messages(self):
+        """History is compact unless the client asks for ?expand=full"""
+        return self.action != "list" or self.request.query_params.get("expand") == "full"
 
     def perform_create(self, serializer):
-        conversation = Conversation.objects.filter(
-            id=self.kwargs.get("conversation_pk"), memberships__user=self.request.user
-        ).first()
-        if not conversation:
+        conversation_id = self.kwargs.get("conversation_pk")
+        if not is_member(self.request.user.id, conversation_id):
             raise exceptions.PermissionDenied("You are not a member of this conversation.")
-        serializer.save(sender=self.request.user, conversation=conversation)
+        serializer.save(sender=self.request.user, conversation_id=int(conversation_id))
 
     def perform_update(self, serializer):
         message = self.get_object()
@@ -177,17 +252,12 @@ class MessageViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, mixins.Upda
         message.save()
         
         # Send WebSocket notification
-        channel_layer = get_channel_layer()
-        group_name = f"conversation_{conversation_pk}"
         serializer = self.get_serializer(message)
-        
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                "type": "message.edited",
-                "message": serializer.data,
-            }
-        )
+        broadcast_to_conversation(message.conversation_id, {
+            "type": "message.edited",
+            "conversation_id": message.conversation_id,
+            "data": serializer.data,
+        })
         
         return Response(serializer.data)
 
@@ -202,16 +272,11 @@ class MessageViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, mixins.Upda
         message.save()
         
         # Send WebSocket notification
-        channel_layer = get_channel_layer()
-        group_name = f"conversation_{conversation_pk}"
-        
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                "type": "message.deleted",
-                "message_id": message.id,
-            }
-        )
+        broadcast_to_conversation(message.conversation_id, {
+            "type": "message.deleted",
+            "conversation_id": message.conversation_id,
+            "message_id": message.id,
+        })
         
         return Response({"status": "message deleted"}, status=status.HTTP_200_OK)
 
@@ -270,30 +335,31 @@ class MessageViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, mixins.Upda
         if not target_conversation_id:
             return Response({"detail": "conversation_id required."}, status=status.HTTP_400_BAD_REQUEST)
         
-        target_conversation = Conversation.objects.filter(
-            id=target_conversation_id,
-            memberships__user=request.user
-        ).first()
-        
-        if not target_conversation:
+        if not is_member(request.user.id, target_conversation_id):
             return Response({"detail": "Conversation not found."}, status=status.HTTP_404_NOT_FOUND)
         
-        forwarded = Message.objects.create(
-            conversation=target_conversation,
-            sender=request.user,
-            message_type=message.message_type,
-            content=message.content,
-            forwarded_from=message
-        )
+        with transaction.atomic():
+            forwarded = Message.objects.create(
+                conversation_id=int(target_conversation_id),
+                sender=request.user,
+                message_type=message.message_type,
+                content=message.content,
+                forwarded_from=message
+            )
+            # Metadata only: the copies reference the same stored blobs
+            share_attachments(message, forwarded)
         
         serializer = MessageSerializer(forwarded)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class ContactViewSet(viewsets.ModelViewSet):
+class ContactViewSet(PresenceMixin, viewsets.ModelViewSet):
     serializer_class = ContactSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def presence_users(self, contacts):
+        return [contact.contact for contact in contacts]
+
     def get_queryset(self):
         return Contact.objects.filter(owner=self.request.user).select_related('contact')
 
@@ -326,22 +392,43 @@ class ContactViewSet(viewsets.ModelViewSet):
         return Response({"status": "favorited" if contact.is_favorite else "unfavorited"})
 
 
-class UserSearchViewSet(viewsets.ReadOnlyModelViewSet):
+class MessageSearchViewSet(viewsets.GenericViewSet):
+    """Ranked full-text search across every conversation the user belongs to"""
+    serializer_class = MessageSearchResultSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    max_results = 50
+
+    def get_queryset(self):
+        user = self.request.user
+        conversation_ids = get_member_conversation_ids(user.id)
+        conversation_id = self.request.query_params.get("conversation_id")
+        if conversation_id is not None:
+            conversation_ids = [int(conversation_id)] if is_member(user.id, conversation_id) else []
+        return (
+            Message.objects.filter(conversation_id__in=conversation_ids)
+            .select_related("sender")
+            .prefetch_related(ATTACHMENTS_PREFETCH, "receipts", "reactions")
+        )
+
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get("q", "").strip()
+        if len(query) < 2:
+            return Response([])
+        results = ranked_search(self.get_queryset(), query, limit=self.max_results)
+        serializer = self.get_serializer(results, many=True)
+        return Response(serializer.data)
+
+
+class UserSearchViewSet(PresenceMixin, viewsets.ReadOnlyModelViewSet):
     """Search for users to add to contacts or conversations"""
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        query = self.request.query_params.get("q", "")
+        query = self.request.query_params.get("q", "").strip()
         if len(query) < 2:
             return User.objects.none()
         
-        queryset = User.objects.filter(
-            Q(username__icontains=query) |
-            Q(display_name__icontains=query) |
-            Q(phone_number__icontains=query)
-        ).exclude(id=self.request.user.id)[:20]
-        
-        return queryset
+        return search_users(query, self.request.user).select_related("settings")
     
     def list(self, request, *args, **kwargs):
         """List users matching search query"""
@@ -354,65 +441,138 @@ class UserSearchViewSet(viewsets.ReadOnlyModelViewSet):
         return UserSerializer
 
 
-from django.http import HttpResponse, Http404
-from django.shortcuts import get_object_or_404
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class UploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """Resumable chunked uploads; see chat.uploads for the protocol"""
+    serializer_class = UploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Upload.objects.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+    def _offset_response(self, upload, status_code=status.HTTP_200_OK):
+        response = Response({"id": upload.id, "offset": upload.offset}, status=status_code)
+        response["Upload-Offset"] = str(upload.offset)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        response["Upload-Offset"] = str(response.data["offset"])
+        return response
+
+    @action(detail=True, methods=["put"], url_path="chunk")
+    def chunk(self, request, pk=None):
+        """Store the bytes in the request body at the offset given by Content-Range"""
+        upload = self.get_object()
+        match = CONTENT_RANGE_RE.match(request.headers.get("Content-Range", ""))
+        if match is None:
+            return Response(
+                {"detail": "Content-Range: bytes <start>-<end>/<size> required."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        start, end, total = (int(value) for value in match.groups())
+        if total != upload.file_size or end < start:
+            return Response({"detail": "Content-Range does not match the upload."}, status=status.HTTP_400_BAD_REQUEST)
+        length = end - start + 1
+        if length > uploads.UPLOAD_MAX_CHUNK_SIZE:
+            return Response(
+                {"detail": f"Chunks are limited to {uploads.UPLOAD_MAX_CHUNK_SIZE} bytes."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        # Read the raw body directly; it is never parsed as form data
+        data = request.stream.read(length + 1) if request.stream else b""
+        if len(data) != length:
+            return Response({"detail": "Body length does not match Content-Range."}, status=status.HTTP_400_BAD_REQUEST)
+        if uploads.write_chunk(upload, start, data) is None:
+            # Resume from the offset the server actually has
+            return self._offset_response(upload, status.HTTP_409_CONFLICT)
+        return self._offset_response(upload)
+
+    @action(detail=True, methods=["post"], url_path="finalize")
+    def finalize(self, request, pk=None):
+        """Verify the checksum; the upload can then be attached with upload_ids"""
+        upload = uploads.finalize(self.get_object())
+        return Response(self.get_serializer(upload).data)
+
+
 from rest_framework.decorators import api_view, permission_classes
-from .models import Attachment
+from .models import Attachment, BlobPreview
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def download_attachment(request, attachment_id):
-    """Download attachment file with proper permissions check"""
-    try:
-        attachment = get_object_or_404(Attachment, id=attachment_id)
-        
-        # Check if user has access to this conversation
-        conversation = attachment.message.conversation
-        if not conversation.memberships.filter(user=request.user).exists():
-            raise exceptions.PermissionDenied("You don't have access to this file")
-        
-        # Get the file
-        if not attachment.file:
-            raise Http404("File not found")
-        
-        # Check if using S3 storage (for production)
-        from django.conf import settings
-        use_s3 = getattr(settings, 'USE_S3', False)
-        
-        if use_s3:
-            # For S3, redirect to the signed URL  
-            from django.shortcuts import redirect
-            file_url = attachment.file.url
-            return redirect(file_url)
-        else:
-            # For local development, serve the file directly
-            from django.http import FileResponse
-            import os
-            
-            # Check if file exists
-            try:
-                file_path = attachment.file.path
-                if not os.path.exists(file_path):
-                    raise Http404("File not found on disk")
-                
-                response = FileResponse(
-                    open(file_path, 'rb'),
-                    content_type=attachment.mime_type or 'application/octet-stream'
-                )
-                response['Content-Disposition'] = f'attachment; filename="{attachment.file_name}"'
-                response['Access-Control-Allow-Origin'] = '*'  # Allow CORS for file downloads
-                response['Access-Control-Allow-Methods'] = 'GET'
-                response['Access-Control-Allow-Headers'] = 'Authorization, Content-Type'
-                
-                return response
-            except ValueError:
-                # If file.path fails (e.g., with S3 URLs), try to serve via URL
-                from django.shortcuts import redirect
-                return redirect(attachment.file.url)
-        
-    except Exception as e:
-        raise Http404(f"File not found: {str(e)}")
+    """
+    Download an attachment, with byte ranges, ETag/Last-Modified revalidation
+    and optional X-Accel-Redirect / X-Sendfile offloading (see core.media)
+    """
+    attachment = get_object_or_404(Attachment.objects.select_related("message"), id=attachment_id)
+
+    # Check if user has access to this conversation
+    if not is_member(request.user.id, attachment.message.conversation_id):
+        raise exceptions.PermissionDenied("You don't have access to this file")
+
+    if not attachment.file:
+        raise Http404("File not found")
+
+    if getattr(settings, 'USE_S3', False):
+        # For S3, redirect to the signed URL
+        return redirect(attachment.file.url)
+
+    if not attachment.file.storage.exists(attachment.file.name):
+        raise Http404("File not found on disk")
+
+    if not attachment.sha256:
+        # Uploaded before hashes were recorded; hash once and keep it
+        attachment.sha256 = file_sha256(attachment.file)
+        attachment.file.close()
+        Attachment.objects.filter(pk=attachment.pk).update(sha256=attachment.sha256)
+
+    response = serve_file(
+        request,
+        attachment.file,
+        content_type=attachment.mime_type or 'application/octet-stream',
+        filename=attachment.file_name,
+        etag=attachment.sha256,
+        last_modified=attachment.message.created_at.timestamp(),
+        # Attachments never change once sent, but are only for members
+        cache_control='private, max-age=31536000, immutable',
+    )
+    response['Access-Control-Allow-Origin'] = '*'  # Allow CORS for file downloads
+    response['Access-Control-Allow-Methods'] = 'GET'
+    response['Access-Control-Allow-Headers'] = 'Authorization, Content-Type, Range'
+    response['Access-Control-Expose-Headers'] = 'Content-Range, Content-Length, ETag'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def attachment_preview(request, attachment_id, variant):
+    """Serve a thumbnail or poster frame generated by chat.previews"""
+    attachment = get_object_or_404(Attachment.objects.select_related("message", "blob"), id=attachment_id)
+    if not is_member(request.user.id, attachment.message.conversation_id):
+        raise exceptions.PermissionDenied("You don't have access to this file")
+    preview = get_object_or_404(BlobPreview, blob_id=attachment.blob_id, variant=variant)
+
+    if getattr(settings, 'USE_S3', False):
+        return redirect(preview.file.url)
+
+    response = serve_file(
+        request,
+        preview.file,
+        content_type=preview.content_type,
+        filename=f"{variant}.{preview.file.name.rsplit('.', 1)[-1]}",
+        # Previews are derived from immutable content, so the blob hash identifies them
+        etag=f"{attachment.blob.sha256}-{variant}",
+        last_modified=attachment.message.created_at.timestamp(),
+        cache_control='private, max-age=31536000, immutable',
+    )
+    response['Access-Control-Allow-Origin'] = '*'
+    return response
 
 
 class CallViewSet(viewsets.ModelViewSet):
@@ -421,82 +581,65 @@ class CallViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        # Get calls from conversations the user is a member of
+        # Calls from conversations the user is a member of; a semi-join, so no DISTINCT
+        member_of = ConversationMembership.objects.filter(user=user).values("conversation_id")
         return Call.objects.filter(
-            conversation__memberships__user=user
-        ).select_related('caller', 'conversation').prefetch_related('participants__user').distinct()
+            conversation_id__in=member_of
+        ).select_related('caller', 'conversation').prefetch_related('participants__user')
 
     def perform_create(self, serializer):
         # Get conversation and validate membership
         conversation_id = self.request.data.get('conversation_id')
-        conversation = get_object_or_404(Conversation, id=conversation_id)
         
         # Check if user is a member of the conversation
-        if not conversation.memberships.filter(user=self.request.user).exists():
+        if not is_member(self.request.user.id, conversation_id):
+            get_object_or_404(Conversation, id=conversation_id)
             raise exceptions.PermissionDenied("You are not a member of this conversation")
         
-        call = serializer.save(caller=self.request.user, conversation=conversation)
-        
-        # Add caller as a participant
-        CallParticipant.objects.create(
-            call=call,
-            user=self.request.user,
-            is_answered=True
+        participant_ids = self.request.data.get('participant_ids')
+        serializer.instance = calls.start_call(
+            int(conversation_id),
+            self.request.user,
+            serializer.validated_data.get('call_type', Call.VOICE),
+            _parse_user_ids(participant_ids) if participant_ids else None,
         )
 
+    def _transition(self, transition, action_name, status_label):
+        call = self.get_object()
+        state = transition(call.id, self.request.user)
+        if state is None:
+            return Response({'detail': f'Cannot {action_name} this call.'}, status=status.HTTP_409_CONFLICT)
+        notify_call_peers_changed(call.conversation_id, call.id)
+        call.refresh_from_db(fields=['duration'])
+        return Response({'status': status_label, 'state': state, 'duration': call.duration})
+
     @action(detail=True, methods=['post'])
     def answer(self, request, pk=None):
         """Answer a call"""
-        call = self.get_object()
-        
-        # Check if user is a participant
-        participant, created = CallParticipant.objects.get_or_create(
-            call=call,
-            user=request.user,
-            defaults={'is_answered': True}
-        )
-        
-        if not created:
-            participant.is_answered = True
-            participant.save()
-        
-        call.state = Call.ACTIVE
-        call.save()
-        
-        return Response({'status': 'answered'})
+        return self._transition(calls.answer_call, 'answer', 'answered')
 
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
         """Reject a call"""
-        call = self.get_object()
-        call.state = Call.DECLINED
-        call.save()
-        
-        return Response({'status': 'rejected'})
+        return self._transition(calls.decline_call, 'reject', 'rejected')
 
     @action(detail=True, methods=['post'])
     def end(self, request, pk=None):
-        """End a call"""
-        call = self.get_object()
-        call.state = Call.ENDED
-        call.ended_at = timezone.now()
-        
-        # Calculate duration if call was active
-        if call.started_at:
-            duration = (call.ended_at - call.started_at).total_seconds()
-            call.duration = int(duration)
-        
-        call.save()
-        
-        return Response({'status': 'ended', 'duration': call.duration})
+        """Leave a call; it ends when fewer than two people remain"""
+        return self._transition(calls.leave_call, 'end', 'ended')
 
     @action(detail=False, methods=['get'])
     def active(self, request):
         """Get active calls for the user"""
         user = request.user
-        active_calls = self.get_queryset().filter(
-            state__in=[Call.INITIATED, Call.RINGING, Call.ACTIVE],
-            participants__user=user
-        )
+        active_calls = calls.live_calls(self.get_queryset()).filter(participants__user=user)
         serializer = self.get_serializer(active_calls, many=True)
         return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def history(self, request):
+        """The user's own call log, newest first, paginated with ?before=<call_id>"""
+        entries = CallParticipant.objects.filter(user=request.user).select_related('call__caller')
+        paginator = CallHistoryPagination()
+        page = paginator.paginate_queryset(entries, request, view=self)
+        return paginator.get_paginated_response(CallHistorySerializer(page, many=True).data)
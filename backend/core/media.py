@@ -0,0 +1,150 @@
+"""
+Serving stored files to authorized clients.
+
+`serve_file` answers conditional requests (ETag / Last-Modified) with 304,
+honours single byte ranges with 206 so audio and video can seek, and can hand
+the transfer to the front-end web server instead of streaming from Python:
+
+    MEDIA_OFFLOAD = "x-accel-redirect"   # nginx, with MEDIA_ACCEL_REDIRECT_PREFIX
+    MEDIA_OFFLOAD = "x-sendfile"         # Apache mod_xsendfile, lighttpd
+
+With offloading, the web server handles Range requests itself.
+"""
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.static import serve
+
+MEDIA_OFFLOAD = getattr(settings, "MEDIA_OFFLOAD", "")
+MEDIA_ACCEL_REDIRECT_PREFIX = getattr(settings, "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+STREAM_CHUNK_SIZE = 64 * 1024
+# Public media whose names change whenever their content does
+IMMUTABLE_MEDIA_PREFIXES = ("avatars/",)
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single-range `Range` header.
+
+    Returns None when the header is absent, malformed or asks for several
+    ranges (the whole file is served instead), and raises ValueError when the
+    range cannot be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def _range_applies(request, etag, last_modified):
+    """An If-Range validator that no longer matches means "send the whole file"."""
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return etag is not None and if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and last_modified is not None and last_modified <= since
+
+
+def _read_range(handle, start, length):
+    try:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        handle.close()
+
+
+def serve_file(request, field_file, *, content_type, filename, etag=None, last_modified=None, cache_control=None):
+    """
+    Build the response for downloading `field_file`.
+
+    `etag` should be a strong validator derived from the content (e.g. its
+    SHA-256) and `last_modified` a Unix timestamp; both are optional.
+    """
+    etag = quote_etag(etag) if etag else None
+    # HTTP dates have whole-second precision
+    last_modified = int(last_modified) if last_modified is not None else None
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        response = not_modified
+    elif MEDIA_OFFLOAD:
+        response = _offloaded_response(field_file, content_type)
+    else:
+        response = _streamed_response(request, field_file, content_type, etag, last_modified)
+
+    if etag:
+        response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    if cache_control:
+        response["Cache-Control"] = cache_control
+    if response.status_code in (200, 206):
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def _offloaded_response(field_file, content_type):
+    response = HttpResponse(content_type=content_type)
+    if MEDIA_OFFLOAD == "x-accel-redirect":
+        response["X-Accel-Redirect"] = MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + field_file.name
+    else:
+        response["X-Sendfile"] = field_file.path
+    return response
+
+
+def _streamed_response(request, field_file, content_type, etag, last_modified):
+    size = field_file.size
+    range_header = request.META.get("HTTP_RANGE") if _range_applies(request, etag, last_modified) else None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    handle = field_file.open("rb")
+    if byte_range is None:
+        return FileResponse(handle, content_type=content_type)
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(_read_range(handle, start, length), status=206, content_type=content_type)
+    response["Content-Length"] = str(length)
+    response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    `django.views.static.serve` for MEDIA_URL, adding a year-long cache for
+    content-hashed files. MEDIA_ROOT is read per request unless given.
+    """
+    response = serve(request, path, document_root=document_root or settings.MEDIA_ROOT, show_indexes=show_indexes)
+    if path.startswith(IMMUTABLE_MEDIA_PREFIXES) and response.status_code == 200:
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
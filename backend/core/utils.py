@@ -1,6 +1,28 @@
+import hashlib
 from uuid import uuid4
 
 
 def generate_upload_path(instance, filename: str) -> str:
     extension = filename.split(".")[-1]
     return f"uploads/{uuid4().hex}.{extension}"
+
+
+def generate_blob_path(instance, filename: str) -> str:
+    """Random path: media is served by name, so it must not reveal the content hash."""
+    name = uuid4().hex
+    return f"blobs/{name[:2]}/{name[2:4]}/{name}"
+
+
+def generate_preview_path(instance, filename: str) -> str:
+    """Random directory per preview, named by variant, e.g. small.webp."""
+    name = uuid4().hex
+    return f"previews/{name[:2]}/{name[2:4]}/{name}/{filename}"
+
+
+def file_sha256(file) -> str:
+    """Hex SHA-256 of a Django File, read in chunks and rewound afterwards."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():  # chunks() rewinds to the start first
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
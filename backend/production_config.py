@@ -147,7 +147,7 @@ LOGGING_CONFIG = {
 WEBSOCKET_CONFIG = {
     'CHANNEL_LAYERS': {
         'default': {
-            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'BACKEND': 'chat.layers.RedisChannelLayer',
             'CONFIG': {
                 'hosts': [('localhost', 6379)],
                 'capacity': 1500,
@@ -150,7 +150,7 @@ SIMPLE_JWT = {
 
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "chat.layers.RedisChannelLayer",
         "CONFIG": {
             "hosts": [env("REDIS_URL")],
         },
@@ -160,5 +160,21 @@ CHANNEL_LAYERS = {
 CELERY_BROKER_URL = env("CELERY_BROKER_URL", default=env("REDIS_URL"))
 CELERY_RESULT_BACKEND = env("CELERY_RESULT_BACKEND", default=env("REDIS_URL"))
 CELERY_TASK_ALWAYS_EAGER = False
+# Attachment previews run in Celery; "inline" builds them in the web process
+CHAT_MEDIA_PIPELINE = env("CHAT_MEDIA_PIPELINE", default="celery")
+CELERY_BEAT_SCHEDULE = {
+    "sweep-stale-calls": {
+        "task": "chat.tasks.sweep_stale_calls",
+        "schedule": 30.0,
+    },
+    "sweep-stale-uploads": {
+        "task": "chat.tasks.sweep_stale_uploads",
+        "schedule": 60 * 60.0,
+    },
+    "flush-presence": {
+        "task": "accounts.tasks.flush_presence",
+        "schedule": 30.0,
+    },
+}
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
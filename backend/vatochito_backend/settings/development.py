@@ -8,6 +8,9 @@ EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 # Use in-memory channel layer for development (no Redis required)
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": "chat.layers.InMemoryChannelLayer"
     }
 }
+
+# No Celery worker in development: build attachment previews in-process
+CHAT_MEDIA_PIPELINE = "inline"
@@ -53,7 +53,7 @@ if REDIS_URL:
     # Production with Redis
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "BACKEND": "chat.layers.RedisChannelLayer",
             "CONFIG": {
                 "hosts": [REDIS_URL],
                 "capacity": 1500,
@@ -61,12 +61,19 @@ if REDIS_URL:
             },
         },
     }
+    # Shared cache so presence, membership sets and OTPs agree across workers
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
     print(f"Using Redis for channel layers: {REDIS_URL}")
 else:
     # Fallback to in-memory (not recommended for production)
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels.layers.InMemoryChannelLayer"
+            "BACKEND": "chat.layers.InMemoryChannelLayer"
         }
     }
     print("WARNING: Using InMemoryChannelLayer - Redis not configured")
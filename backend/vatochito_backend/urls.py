@@ -5,6 +5,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from core.media import serve_media
+
 
 def api_root(request):
     return JsonResponse({
@@ -32,4 +34,4 @@ urlpatterns = [
 
 # Serve media files in production (handled by Whitenoise)
 if settings.DEBUG or True:  # Always serve media files for now
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media)
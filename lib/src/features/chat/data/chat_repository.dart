@@ -4,6 +4,7 @@ import 'package:vatochito_chat/src/core/network/api_client.dart';
 import 'package:vatochito_chat/src/core/network/websocket_service.dart';
 import 'package:vatochito_chat/src/features/chat/data/models/conversation_model.dart';
 import 'package:vatochito_chat/src/features/chat/data/models/message_model.dart';
+import 'package:vatochito_chat/src/features/chat/data/models/message_page.dart';
 
 class ChatRepository {
   ChatRepository({
@@ -20,12 +21,16 @@ class ChatRepository {
     return data.map(ConversationModel.fromJson).toList();
   }
 
-  Future<List<MessageModel>> fetchMessages(int conversationId) async {
+  /// Fetches a page of history, newest first; pass [before] (the oldest
+  /// message id already loaded) to continue with older messages.
+  Future<MessagePage> fetchMessages(int conversationId, {int? before}) async {
     final response = await _client.get<dynamic>(
       AppEndpoints.conversationMessages(conversationId),
+      queryParameters: {if (before != null) 'before': before},
+    );
+    return MessagePage.fromJson(
+      Map<String, dynamic>.from(response.data as Map),
     );
-    final data = List<Map<String, dynamic>>.from(response.data as List);
-    return data.map(MessageModel.fromJson).toList();
   }
 
   Future<ConversationModel?> createConversation(int userId) async {
@@ -0,0 +1,23 @@
+import 'package:equatable/equatable.dart';
+import 'package:vatochito_chat/src/features/chat/data/models/message_model.dart';
+
+/// One page of message history, newest message first.
+class MessagePage extends Equatable {
+  const MessagePage({required this.messages, required this.hasMore});
+
+  factory MessagePage.fromJson(Map<String, dynamic> json) {
+    final results = List<Map<String, dynamic>>.from(json['results'] as List);
+    return MessagePage(
+      messages: results.map(MessageModel.fromJson).toList(),
+      hasMore: json['has_more'] as bool? ?? false,
+    );
+  }
+
+  final List<MessageModel> messages;
+
+  /// Whether older messages exist before the last one in [messages].
+  final bool hasMore;
+
+  @override
+  List<Object?> get props => [messages, hasMore];
+}
@@ -18,12 +18,13 @@ class ChatRoomCubit extends Cubit<ChatRoomState> {
   final Future<int?> Function() _getUserId;
   StreamSubscription<dynamic>? _channelSubscription;
   WebSocketChannel? _channel;
+  bool _loadingOlder = false;
 
   Future<void> connect(int conversationId) async {
     emit(state.copyWith(status: ChatRoomStatus.loading));
     try {
-      final messages = await _repository.fetchMessages(conversationId);
-      emit(state.copyWith(messages: messages));
+      final page = await _repository.fetchMessages(conversationId);
+      emit(state.copyWith(messages: page.messages, hasMore: page.hasMore));
 
       _channel = await _repository.websocketService.connect(conversationId);
       _channelSubscription = _channel!.stream.listen(
@@ -73,6 +74,27 @@ class ChatRoomCubit extends Cubit<ChatRoomState> {
     }
   }
 
+  Future<void> loadOlderMessages(int conversationId) async {
+    if (_loadingOlder || !state.hasMore || state.messages.isEmpty) {
+      return;
+    }
+    _loadingOlder = true;
+    try {
+      final page = await _repository.fetchMessages(
+        conversationId,
+        before: state.messages.last.id,
+      );
+      emit(state.copyWith(
+        messages: [...state.messages, ...page.messages],
+        hasMore: page.hasMore,
+      ));
+    } catch (e) {
+      emit(state.copyWith(errorMessage: 'Failed to load older messages'));
+    } finally {
+      _loadingOlder = false;
+    }
+  }
+
   Future<void> sendMessage(String content, int conversationId) async {
     developer.log('ChatRoomCubit.sendMessage called', name: 'ChatRoomCubit');
     developer.log('Content: "$content"', name: 'ChatRoomCubit');
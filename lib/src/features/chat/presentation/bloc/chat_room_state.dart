@@ -6,26 +6,30 @@ class ChatRoomState extends Equatable {
   const ChatRoomState({
     this.status = ChatRoomStatus.initial,
     this.messages = const [],
+    this.hasMore = false,
     this.errorMessage,
   });
 
   final ChatRoomStatus status;
   final List<MessageModel> messages;
+  final bool hasMore;
   final String? errorMessage;
 
   ChatRoomState copyWith({
     ChatRoomStatus? status,
     List<MessageModel>? messages,
+    bool? hasMore,
     String? errorMessage,
     bool clearError = false,
   }) {
     return ChatRoomState(
       status: status ?? this.status,
       messages: messages ?? this.messages,
+      hasMore: hasMore ?? this.hasMore,
       errorMessage: clearError ? null : (errorMessage ?? this.errorMessage),
     );
   }
 
   @override
-  List<Object?> get props => [status, messages, errorMessage];
+  List<Object?> get props => [status, messages, hasMore, errorMessage];
 }
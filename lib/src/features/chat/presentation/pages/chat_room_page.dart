@@ -40,6 +40,7 @@ class _ChatRoomPageState extends State<ChatRoomPage>
   void initState() {
     super.initState();
     context.read<ChatRoomCubit>().connect(widget.conversationId);
+    _scrollController.addListener(_onScroll);
     _attachmentAnimationController = AnimationController(
       vsync: this,
       duration: const Duration(milliseconds: 300),
@@ -55,6 +56,14 @@ class _ChatRoomPageState extends State<ChatRoomPage>
     super.dispose();
   }
 
+  void _onScroll() {
+    // The list is reversed, so the end of the scroll extent is the oldest message
+    final position = _scrollController.position;
+    if (position.pixels >= position.maxScrollExtent - 200) {
+      context.read<ChatRoomCubit>().loadOlderMessages(widget.conversationId);
+    }
+  }
+
   void _toggleEmojiPicker() {
     _focusNode.unfocus();
     setState(() {